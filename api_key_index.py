@@ -0,0 +1,68 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+
+class ApiKeyIndex:
+
+    def __init__(self, loader, refresh_interval=None, changed_at=None, check_interval=None):
+        # loader returns (key, consumer_id) pairs, it is only called at startup and every refresh_interval seconds.
+        # Without changed_at a key added or deleted through another worker is only noticed here after refresh_interval.
+        self.loader = loader
+        self.refresh_interval = refresh_interval or float(os.getenv("API_KEY_INDEX_REFRESH", 60))
+        # changed_at returns the wall-clock time keys were last added or removed by any worker, or None. It is polled
+        # every check_interval seconds and a newer time than our last refresh reloads the index straight away.
+        self.changed_at = changed_at
+        self.check_interval = check_interval or float(os.getenv("API_KEY_INDEX_CHECK", 2))
+        self.keys = {}
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.loaded_at_wall = None
+        self.checked_at = None
+
+    def digest(self, key):
+        return hashlib.sha256(key.encode("utf-8")).digest()
+
+    def refresh(self):
+        # Taken before loading, a key deleted while the loader runs is picked up by the next check
+        started_at = time.time()
+        keys = {self.digest(key): (key, consumer_id) for key, consumer_id in self.loader() if key}
+        with self.lock:
+            self.keys = keys
+            self.loaded_at = time.monotonic()
+            self.loaded_at_wall = started_at
+
+    def add(self, key, consumer_id):
+        with self.lock:
+            self.keys[self.digest(key)] = (key, consumer_id)
+
+    def remove(self, key):
+        with self.lock:
+            self.keys.pop(self.digest(key), None)
+
+    def stale(self):
+        now = time.monotonic()
+        if self.loaded_at is None or now - self.loaded_at > self.refresh_interval:
+            return True
+        if self.changed_at is None or (self.checked_at is not None and now - self.checked_at < self.check_interval):
+            return False
+        self.checked_at = now
+        changed_at = self.changed_at()
+        return changed_at is not None and changed_at >= self.loaded_at_wall
+
+    def lookup(self, key):
+        if not key:
+            return None
+        # Keys registered or deleted through another gunicorn worker show up here within check_interval when
+        # there is a shared cache to announce it in, and on the next full refresh when there isn't
+        if self.stale():
+            self.refresh()
+        entry = self.keys.get(self.digest(key))
+        if entry is not None and hmac.compare_digest(entry[0].encode("utf-8"), key.encode("utf-8")):
+            return entry[1]
+        return None
+
+    def __len__(self):
+        return len(self.keys)
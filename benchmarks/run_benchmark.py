@@ -0,0 +1,217 @@
+"""Drives the API end to end against a seeded SQLite database, offline.
+
+The translator is the http backend pointed at a local mock translation server and StoryManager reads
+mundoprimaria-style pages from a local story site, so nothing leaves the machine. Run from the repo root:
+
+    python benchmarks/run_benchmark.py --concurrency 1 4 16 --requests 500
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from urllib.parse import unquote
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import requests
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+ADMIN_KEY = "benchmark-admin-key"
+# Shared by every run so the miss and story scenarios never ask for the same word or title twice
+request_numbers = itertools.count()
+
+
+class StorySiteHandler(BaseHTTPRequestHandler):
+    with open(os.path.join(BENCHMARK_DIR, "sample_story.html"), encoding="utf-8") as file:
+        template = Template(file.read())
+
+    def do_GET(self):
+        slug = unquote(self.path.rstrip("/").rsplit("/", 1)[-1])
+        body = self.template.substitute(slug=slug, title=slug.replace("-", " ").capitalize()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockTranslatorHandler(BaseHTTPRequestHandler):
+    # Speaks the protocol of translation_backends.HttpTranslationBackend
+    latency = 0.0
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.latency)
+        body = json.dumps({"translations": [f"[en] {text}" for text in request["q"]]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def seed(main, words, stories):
+    word_lines = "".join(json.dumps({"es": f"palabra{i}", "en": f"word{i}"}) + "\n" for i in range(words))
+    main.bulk_loader.import_words(io.StringIO(word_lines), "jsonl")
+    story_lines = "".join(json.dumps({
+        "title": f"Cuento {i}",
+        "paragraphs": [{"es": f"Cuento {i}, párrafo {j}.", "en": f"Story {i}, paragraph {j}."} for j in range(20)]
+    }) + "\n" for i in range(stories))
+    main.bulk_loader.import_stories(io.StringIO(story_lines))
+    return [row.id for row in main.db.session.query(main.Story.id).all()]
+
+
+def run_load(call, concurrency, total):
+    local = threading.local()
+
+    def one_request(_):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session.headers["x-api-key"] = ADMIN_KEY
+        start = time.perf_counter()
+        ok = call(local.session, next(request_numbers))
+        return time.perf_counter() - start, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one_request, range(total)))
+    elapsed = time.perf_counter() - started
+    latencies = [latency for latency, ok in results if ok]
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": sum(1 for _, ok in results if not ok),
+        "throughput": total / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000
+    }
+
+
+def scenarios(api_url, story_ids, words, run_id):
+    def translate_hit(session, i):
+        return session.get(f"{api_url}/translate", params={"es": f"palabra{random.randrange(words)}"}).ok
+
+    def translate_miss(session, i):
+        return session.get(f"{api_url}/translate", params={"es": f"nueva-{run_id}-{i}"}).ok
+
+    def fetch_story(session, i):
+        return session.get(f"{api_url}/fetch-story", params={"id": random.choice(story_ids)}).ok
+
+    def all_stories(session, i):
+        return session.get(f"{api_url}/all-stories").ok
+
+    def story(session, i):
+        # Ingestion is a background job, so this times submit-to-done rather than the 202
+        response = session.get(f"{api_url}/story", params={"title": f"bench-{run_id}-{i}"})
+        if response.status_code != 202:
+            return False
+        job_id = response.json()["response"]["job_id"]
+        deadline = time.monotonic() + 120
+        while time.monotonic() < deadline:
+            status = session.get(f"{api_url}/jobs/{job_id}").json()["response"]["status"]
+            if status in ("done", "failed"):
+                return status == "done"
+            time.sleep(0.05)
+        return False
+
+    return {
+        "translate_hit": translate_hit,
+        "translate_miss": translate_miss,
+        "fetch_story": fetch_story,
+        "all_stories": all_stories,
+        "story": story
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hola API offline")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=300, help="requests per scenario and concurrency level")
+    parser.add_argument("--story-requests", type=int, default=10, help="stories ingested per concurrency level")
+    parser.add_argument("--words", type=int, default=5000)
+    parser.add_argument("--stories", type=int, default=200)
+    parser.add_argument("--translator-latency", type=float, default=0.05, help="seconds the mock translator sleeps")
+    parser.add_argument("--scenario", nargs="+", default=None, help="only run these scenarios")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    MockTranslatorHandler.latency = args.translator_latency
+    translator_url = start_server(ThreadingHTTPServer(("127.0.0.1", 0), MockTranslatorHandler))
+    story_site_url = start_server(ThreadingHTTPServer(("127.0.0.1", 0), StorySiteHandler))
+
+    database = tempfile.NamedTemporaryFile(prefix="hola-benchmark-", suffix=".db", delete=False)
+    database.close()
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{database.name}",
+        "SECRET_KEY": "benchmark",
+        "ADMIN_KEY": ADMIN_KEY,
+        "TRANSLATION_BACKEND": "http",
+        "TRANSLATION_HTTP_URL": f"{translator_url}/translate",
+        "STORY_BASE_URL": f"{story_site_url}/cuentos-infantiles-cortos/cuentos-populares/",
+        "RUN_JOBS_IN_WEB": "1",
+        "JOB_POLL_INTERVAL": "0.1"
+    })
+
+    import main as hola
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    story_ids = seed(hola, args.words, args.stories)
+    api_server = make_server("127.0.0.1", 0, hola.app, threaded=True, request_handler=QuietRequestHandler)
+    api_url = start_server(api_server)
+
+    run_id = int(time.time())
+    all_scenarios = scenarios(api_url, story_ids, args.words, run_id)
+    selected = args.scenario or list(all_scenarios)
+
+    results = []
+    print(f"{'scenario':<16}{'conc':>6}{'reqs':>7}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name in selected:
+        for concurrency in args.concurrency:
+            total = args.story_requests if name == "story" else args.requests
+            result = run_load(all_scenarios[name], concurrency, total)
+            result["scenario"] = name
+            results.append(result)
+            print(f"{name:<16}{concurrency:>6}{total:>7}{result['errors']:>8}{result['throughput']:>10.1f}"
+                  f"{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    api_server.shutdown()
+    os.remove(database.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from text_normalization import clean, normalize
+import csv
+import io
+import json
+import os
+
+
+class BulkLoader:
+    # Loads and dumps translations and stories in batches. Rows that already exist are skipped, never overwritten.
+
+    def __init__(self, db, batch_size=None):
+        self.db = db
+        self.batch_size = batch_size or int(os.getenv("BULK_BATCH_SIZE", 1000))
+        self.words = db.metadata.tables["words"]
+        self.stories = db.metadata.tables["stories"]
+        self.paragraphs = db.metadata.tables["paragraphs"]
+
+    def read_records(self, file, file_format):
+        if file_format == "csv":
+            yield from csv.DictReader(file)
+        elif file_format == "jsonl":
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            raise ValueError(f"Unsupported format: {file_format}")
+
+    def batches(self, records):
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def insert_ignoring_conflicts(self, connection, table, rows):
+        dialect = connection.dialect.name
+        if dialect == "postgresql":
+            statement = postgresql.insert(table).on_conflict_do_nothing()
+        elif dialect == "sqlite":
+            statement = table.insert().prefix_with("OR IGNORE")
+        else:
+            statement = table.insert()
+        # One executemany per batch, rowcount is the number of rows actually inserted
+        return connection.execute(statement, rows).rowcount
+
+    def import_words(self, file, file_format):
+        read = 0
+        inserted = 0
+        with self.db.engine.begin() as connection:
+            for batch in self.batches(self.read_records(file, file_format)):
+                rows = [{"es": clean(record["es"]), "en": record["en"], "key": normalize(record["es"])}
+                        for record in batch if normalize(record.get("es"))]
+                read += len(batch)
+                if rows:
+                    inserted += self.insert_ignoring_conflicts(connection, self.words, rows)
+        return read, inserted
+
+    def import_stories(self, file, file_format="jsonl"):
+        # One story per line: {"title": ..., "paragraphs": [{"es": ..., "en": ...}, ...]}
+        read = 0
+        inserted = 0
+        with self.db.engine.begin() as connection:
+            for batch in self.batches(self.read_records(file, file_format)):
+                read += len(batch)
+                titles = [record["title"] for record in batch]
+                existing = {row.title for row in connection.execute(
+                    select([self.stories.c.title]).where(self.stories.c.title.in_(titles)))}
+                new_stories = {}
+                for record in batch:
+                    if record["title"] not in existing:
+                        new_stories.setdefault(record["title"], record)
+                if not new_stories:
+                    continue
+                self.insert_ignoring_conflicts(connection, self.stories,
+                                               [{"title": title} for title in new_stories])
+                story_ids = {row.title: row.id for row in connection.execute(
+                    select([self.stories.c.id, self.stories.c.title])
+                    .where(self.stories.c.title.in_(list(new_stories))))}
+                paragraphs = [{"es": paragraph["es"], "en": paragraph["en"], "story_id": story_ids[title]}
+                              for title, record in new_stories.items()
+                              for paragraph in record.get("paragraphs", [])]
+                if paragraphs:
+                    self.insert_ignoring_conflicts(connection, self.paragraphs, paragraphs)
+                inserted += len(new_stories)
+        return read, inserted
+
+    def export_words(self, file_format):
+        query = select([self.words.c.es, self.words.c.en]).order_by(self.words.c.es)
+        connection = self.db.engine.connect().execution_options(stream_results=True)
+        try:
+            if file_format == "csv":
+                yield self.csv_line(["es", "en"])
+                for row in connection.execute(query):
+                    yield self.csv_line([row.es, row.en])
+            elif file_format == "jsonl":
+                for row in connection.execute(query):
+                    yield json.dumps({"es": row.es, "en": row.en}, ensure_ascii=False) + "\n"
+            else:
+                raise ValueError(f"Unsupported format: {file_format}")
+        finally:
+            connection.close()
+
+    def export_stories(self):
+        query = select([self.stories.c.id, self.stories.c.title, self.paragraphs.c.es, self.paragraphs.c.en])\
+            .select_from(self.stories.outerjoin(self.paragraphs, self.paragraphs.c.story_id == self.stories.c.id))\
+            .order_by(self.stories.c.id, self.paragraphs.c.id)
+        connection = self.db.engine.connect().execution_options(stream_results=True)
+        try:
+            story = None
+            for row in connection.execute(query):
+                if story is None or story["id"] != row.id:
+                    if story is not None:
+                        yield self.story_line(story)
+                    story = {"id": row.id, "title": row.title, "paragraphs": []}
+                if row.es is not None:
+                    story["paragraphs"].append({"es": row.es, "en": row.en})
+            if story is not None:
+                yield self.story_line(story)
+        finally:
+            connection.close()
+
+    def csv_line(self, values):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(values)
+        return buffer.getvalue()
+
+    def story_line(self, story):
+        return json.dumps({"title": story["title"], "paragraphs": story["paragraphs"]}, ensure_ascii=False) + "\n"
@@ -1,62 +1,215 @@
+from collections import OrderedDict
+import glob
+import gzip
 import json
+import os
+import tempfile
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process locking on Windows, appends from a single process are still safe
+    fcntl = None
+
+
+class TranslationLog:
+
+    def __init__(self, path, legacy_path=None):
+        self.path = path
+        self.legacy_path = legacy_path
+        # es -> en in the order they were first saved, later lines for the same es win
+        self.entries = {}
+        self.lines = 0
+        self.offset = 0
+        # (inode, first line) of the file the index was read from. Compaction starts the file with a new
+        # generation line, so a rewritten log is noticed even if the filesystem hands it a recycled inode.
+        self.identity = None
+        self.lock = threading.RLock()
+
+    def catch_up(self):
+        with self.lock:
+            try:
+                file = open(self.path, "rb")
+            except FileNotFoundError:
+                if self.identity is None and self.legacy_path and os.path.exists(self.legacy_path):
+                    self.import_legacy()
+                return
+            with file:
+                identity = (os.fstat(file.fileno()).st_ino, file.readline())
+                if identity != self.identity:
+                    # First read, or the log was compacted by someone else: start over
+                    self.entries = {}
+                    self.lines = 0
+                    self.offset = 0
+                    self.identity = identity
+                file.seek(self.offset)
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        # Half-written by an appender that hasn't finished, read it next time
+                        break
+                    self.offset += len(line)
+                    try:
+                        record = json.loads(line)
+                        if "generation" in record:
+                            continue
+                        self.entries[record["es"]] = record["en"]
+                        self.lines += 1
+                    except (ValueError, KeyError):
+                        print(f"Skipping bad line in {self.path}")
+
+    def import_legacy(self):
+        # Files/{title}.txt used to hold the whole story as one {"content": [...]} document
+        try:
+            with open(self.legacy_path) as file:
+                content = json.load(file)["content"]
+        except (ValueError, KeyError) as e:
+            print(f"Could not read {self.legacy_path}: {e}")
+            return
+        self.entries = {paragraph["es"]: paragraph["en"] for paragraph in content}
+        self.write_compacted()
+
+    def append(self, es, en):
+        line = (json.dumps({"es": es, "en": en}, ensure_ascii=False) + "\n").encode("utf-8")
+        with self.lock:
+            while True:
+                file_descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    if fcntl:
+                        fcntl.flock(file_descriptor, fcntl.LOCK_EX)
+                        # A compaction may have replaced the file while we waited for the lock
+                        if os.fstat(file_descriptor).st_ino != os.stat(self.path).st_ino:
+                            continue
+                    # One write of a whole line on an O_APPEND descriptor, appenders never interleave
+                    os.write(file_descriptor, line)
+                    break
+                finally:
+                    os.close(file_descriptor)
+            self.catch_up()
+
+    def needs_compaction(self, ratio):
+        return self.lines > 100 and self.lines > ratio * len(self.entries)
+
+    def compact(self):
+        with self.lock:
+            while True:
+                lock_descriptor = os.open(self.path, os.O_RDONLY)
+                try:
+                    if fcntl:
+                        fcntl.flock(lock_descriptor, fcntl.LOCK_EX)
+                        # Another process compacted it while we waited, lock the log that replaced it
+                        if os.fstat(lock_descriptor).st_ino != os.stat(self.path).st_ino:
+                            continue
+                    # Lines other processes appended before we got the lock must survive the rewrite
+                    self.catch_up()
+                    self.write_compacted()
+                    break
+                finally:
+                    os.close(lock_descriptor)
+
+    def write_compacted(self):
+        # Rewritten beside the log and renamed over it, readers see either the old log or the new one
+        header = (json.dumps({"generation": uuid.uuid4().hex}) + "\n").encode("utf-8")
+        body = b"".join((json.dumps({"es": es, "en": en}, ensure_ascii=False) + "\n").encode("utf-8")
+                        for es, en in self.entries.items())
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                file.write(header + body)
+                inode = os.fstat(file.fileno()).st_ino
+            os.replace(temporary_path, self.path)
+        except OSError:
+            os.remove(temporary_path)
+            raise
+        # Anything appended to the new file from here on is picked up by the next catch_up
+        self.identity = (inode, header)
+        self.offset = len(header) + len(body)
+        self.lines = len(self.entries)
 
 
 class FileManager:
 
+    def __init__(self, directory=None, max_open_logs=None):
+        self.directory = directory or os.getenv("FILES_DIR", "Files")
+        # One gzipped /fetch-story body per story version, written once and sent as-is with sendfile
+        self.bundle_directory = os.path.join(self.directory, "bundles")
+        # title -> TranslationLog, an append-only {title}.jsonl with every translation indexed in memory.
+        # Only the most recently used logs stay indexed, an evicted one is read back from disk when next needed.
+        self.logs = OrderedDict()
+        self.max_open_logs = max_open_logs or int(os.getenv("FILES_MAX_OPEN_LOGS", 64))
+        self.lock = threading.Lock()
+        # A log is rewritten once it holds this many lines per distinct translation
+        self.compact_ratio = float(os.getenv("FILES_COMPACT_RATIO", 2))
+
+    def log_path(self, title):
+        return os.path.join(self.directory, f"{title.replace(os.sep, '_')}.jsonl")
+
+    def translation_log(self, title):
+        with self.lock:
+            log = self.logs.get(title)
+            if log is None:
+                log = TranslationLog(self.log_path(title), os.path.join(self.directory, f"{title}.txt"))
+                log.catch_up()
+                self.logs[title] = log
+                while len(self.logs) > self.max_open_logs:
+                    self.logs.popitem(last=False)
+            else:
+                self.logs.move_to_end(title)
+        return log
+
     def check_for_existing_translation(self, text, title):
-        file_path = f"Files/{title}.txt"
-        try:
-            with open(file_path) as file:
-                data = json.load(file)
-                text = [paragraph["en"] for paragraph in data["content"] if paragraph["es"] == text][0]
-                return text
-        except FileNotFoundError:
-            return None
-        except KeyError:
-            return None
-        except IndexError:
-            return None
+        log = self.translation_log(title)
+        en = log.entries.get(text)
+        if en is None:
+            # Only a miss pays for reading what other processes have appended since
+            log.catch_up()
+            en = log.entries.get(text)
+        return en
 
     def save_new_translation(self, translation, title):
-        file_path = f"Files/{title}.txt"
-        new_object = {
-            "es": translation[0],
-            "en": translation[1]
-        }
-        try:
-            with open(file_path, "r") as file:
-                data = json.load(file)
-        except FileNotFoundError:
-            with open(file_path, "w") as file:
-                initial_json = {
-                    "content": [
-                        new_object
-                    ]
-                }
-                json.dump(initial_json, file)
-        else:
-            with open(file_path, "w") as file:
-                data["content"].append(new_object)
-                json.dump(data, file)
+        os.makedirs(self.directory, exist_ok=True)
+        log = self.translation_log(title)
+        log.append(translation[0], translation[1])
+        if log.needs_compaction(self.compact_ratio):
+            log.compact()
 
     def return_story(self, title):
-        file_path = f"Files/{title}.txt"
-        try:
-            with open(file_path) as file:
-                data = json.load(file)
-                spanish = [paragraph["es"] for paragraph in data["content"]]
-                english = [paragraph["en"] for paragraph in data["content"]]
-                final_str = ""
-                final_str += "********* SPANISH *********\n"
-                for i in range(len(spanish)):
-                    final_str += f"{spanish[i]}\n"
-                final_str += "********* ENGLISH *********\n"
-                for i in range(len(english)):
-                    final_str += f"{english[i]}\n"
-                return final_str
-        except FileNotFoundError:
-            return None
-        except KeyError:
-            return None
-        except IndexError:
+        log = self.translation_log(title)
+        with log.lock:
+            log.catch_up()
+            entries = dict(log.entries)
+        if not entries:
             return None
+        return "".join(["********* SPANISH *********\n", *(f"{es}\n" for es in entries),
+                        "********* ENGLISH *********\n", *(f"{en}\n" for en in entries.values())])
+
+    def bundle_path(self, story_id, version):
+        return os.path.join(self.bundle_directory, f"story-{story_id}-v{version}.json.gz")
+
+    def story_bundle(self, story_id, version):
+        path = self.bundle_path(story_id, version)
+        return path if os.path.exists(path) else None
+
+    def write_story_bundle(self, story_id, version, body):
+        os.makedirs(self.bundle_directory, exist_ok=True)
+        path = self.bundle_path(story_id, version)
+        # Written next to its final name and renamed into place, so a reader never sees half a bundle
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.bundle_directory, suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                file.write(gzip.compress(body, compresslevel=9, mtime=0))
+            os.replace(temporary_path, path)
+        except OSError:
+            os.remove(temporary_path)
+            raise
+        self.delete_story_bundles(story_id, keep=path)
+        return path
+
+    def delete_story_bundles(self, story_id, keep=None):
+        for path in glob.glob(os.path.join(self.bundle_directory, f"story-{story_id}-v*.json.gz")):
+            if path != keep:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
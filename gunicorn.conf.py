@@ -0,0 +1,9 @@
+import os
+import shutil
+
+
+def on_starting(server):
+    # Metrics snapshots from a previous run would otherwise be added to this run's counters
+    directory = os.getenv("METRICS_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,34 @@
+import os
+import threading
+
+
+class InflightLimitExceeded(Exception):
+    pass
+
+
+class InflightLimiter:
+    # Caps how many requests can be waiting on the translator at once. Past the cap requests are turned away
+    # straight away instead of queueing for a translator session, so cache and database hits keep being served.
+
+    def __init__(self, max_inflight=None, retry_after=None):
+        self.max_inflight = max_inflight or int(os.getenv("TRANSLATE_MAX_INFLIGHT", 20))
+        self.retry_after = retry_after or int(os.getenv("TRANSLATE_RETRY_AFTER", 5))
+        self.in_flight = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        with self.lock:
+            if self.in_flight >= self.max_inflight:
+                self.rejected += 1
+                raise InflightLimitExceeded(f"{self.in_flight} translations already in flight")
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": self.in_flight, "max": self.max_inflight, "rejected": self.rejected}
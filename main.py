@@ -1,24 +1,61 @@
-from sqlalchemy import exc, or_
+from sqlalchemy import exc, or_, case, bindparam
 from sqlalchemy.orm import relationship
-from flask import Flask, render_template, redirect, url_for, flash, abort, jsonify, request
+from flask import Flask, render_template, redirect, url_for, flash, abort, jsonify, request, Response, \
+    stream_with_context
+from werkzeug.wsgi import wrap_file
 from flask_login import UserMixin, login_user, LoginManager, current_user, logout_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_sqlalchemy import SQLAlchemy
 import os
 import smtplib
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, PasswordField, TextAreaField
 from wtforms.validators import DataRequired, Email, EqualTo, Length
 from functools import wraps
 import uuid
+import json
+import io
+import click
+import hmac
+import atexit
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask_bootstrap import Bootstrap
 import flask_monitoringdashboard as dashboard
-from selenium_translation_manager import SeleniumTranslationManger
-from file_manager import FileManager
+from translator_pool import TranslatorPoolExhausted
+from translation_backends import create_translation_backend
+from translation_cache import TranslationCache
+from inflight_limiter import InflightLimiter, InflightLimitExceeded
+from single_flight import FlightTimeout, SingleFlight
+from shared_cache import create_shared_cache
+from api_key_index import ApiKeyIndex
+from rate_limiter import RateLimiter
+from usage_meter import UsageMeter
+from migrations import add_missing_columns, backfill_column, create_missing_indexes, drop_unique_constraints, \
+    missing_columns, remove_duplicates
+from text_normalization import clean, normalize
+from search_index import SearchIndex
+from bulk_loader import BulkLoader
+from translation_memory import TranslationMemory
+from pool_monitor import PoolMonitor
+from metrics import registry
+import time
+from apscheduler.schedulers.background import BackgroundScheduler
 from story_manager import StoryManager
+from story_crawler import StoryCrawler
+from file_manager import FileManager
 
 app = Flask(__name__)
+
+# METRICS
+REQUEST_SECONDS = registry.histogram("hola_request_seconds", "Request latency by endpoint and status",
+                                     ("endpoint", "status"))
+API_KEY_SECONDS = registry.histogram("hola_api_key_check_seconds", "Time taken to authenticate an API key")
+WORDS_LOOKUP_SECONDS = registry.histogram("hola_words_lookup_seconds", "Time taken to look words up in the database")
+TRANSLATE_REJECTED = registry.counter("hola_translate_rejected_total",
+                                      "Translation requests turned away because the translator was saturated", ("reason",))
+STORY_SENTENCES = registry.counter("hola_story_sentences_total", "Story sentences by where their translation came from",
+                                   ("source",))
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
 Bootstrap(app)
 
@@ -28,14 +65,49 @@ dashboard.bind(app)
 # CONNECT TO DB
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL", "sqlite:///hola.db")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+pool_monitor = PoolMonitor()
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith("sqlite"):
+    # Pre-ping and recycle let the pool ride out Postgres restarts and idle connection reaping
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        "poolclass": pool_monitor.pool_class(),
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    }
 db = SQLAlchemy(app)
+pool_monitor.attach(db.engine)
 
 # LOGIN MANAGER
 login_manager = LoginManager()
 login_manager.init_app(app)
 
 # TRANSLATION MANAGER
-translator = None
+translation_backend = create_translation_backend()
+atexit.register(translation_backend.close)
+translation_cache = TranslationCache()
+
+# SHARED CACHE
+shared_cache = create_shared_cache()
+SHARED_CACHE_TTL = float(os.getenv("SHARED_CACHE_TTL", 86400))
+NEGATIVE_CACHE_TTL = float(os.getenv("NEGATIVE_CACHE_TTL", 300))
+TRANSLATE_LOCK_TTL = float(os.getenv("TRANSLATE_LOCK_TTL", 60))
+# Kept below TRANSLATE_FLIGHT_TIMEOUT, so requests coalesced behind a waiting request are still there when it gives up
+TRANSLATE_LOCK_WAIT = float(os.getenv("TRANSLATE_LOCK_WAIT", 30))
+# Requests that missed every cache and are waiting on the translator
+translate_limiter = InflightLimiter()
+# Concurrent misses for the same word in this process wait on one translation instead of each starting their own
+translate_flights = SingleFlight(timeout=float(os.getenv("TRANSLATE_FLIGHT_TIMEOUT", 45)))
+
+# PAGINATION
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", 100))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 1000))
+
+# Serialized /fetch-story bodies keyed by (story id, version), so an edit never needs to invalidate them
+story_response_cache = TranslationCache(max_size=int(os.getenv("STORY_RESPONSE_CACHE_SIZE", 500)))
+file_manager = FileManager()
+
 
 # CONFIGURE TABLES
 class Consumer(UserMixin, db.Model):
@@ -53,12 +125,17 @@ class Words(db.Model):
     __tablename__ = 'words'
     es = db.Column(db.String(100), unique=True, primary_key=True)
     en = db.Column(db.String(100))
+    # text_normalization.normalize(es), what /translate looks words up by
+    key = db.Column(db.String(100), unique=True, index=True, nullable=True)
 
 
 class Story(db.Model):
     __tablename__ = 'stories'
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), unique=True, nullable=True)
+    # Bumped by story_changed() whenever the title or paragraphs change, clients see it as the story's ETag
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
 
     paragraphs = relationship('Paragraph', back_populates='story')
 
@@ -66,14 +143,80 @@ class Story(db.Model):
 class Paragraph(db.Model):
     __tablename__ = 'paragraphs'
     id = db.Column(db.Integer, primary_key=True)
-    es = db.Column(db.String(), unique=True, nullable=False)
-    en = db.Column(db.String(), unique=True, nullable=False)
+    # Not unique: stories share stock phrases, and two paragraphs can translate to the same English
+    es = db.Column(db.String(), nullable=False)
+    en = db.Column(db.String(), nullable=False)
 
     story_id = db.Column(db.Integer, db.ForeignKey('stories.id'))
     story = relationship('Story', back_populates='paragraphs')
 
 
+class Sentence(db.Model):
+    # Translation memory, key is the sha1 of the whitespace-normalised Spanish sentence
+    __tablename__ = 'sentences'
+    key = db.Column(db.String(40), primary_key=True)
+    es = db.Column(db.String(), nullable=False)
+    en = db.Column(db.String(), nullable=False)
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    payload = db.Column(db.String(200), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default="queued", index=True)
+    paragraphs_total = db.Column(db.Integer, default=0)
+    paragraphs_done = db.Column(db.Integer, default=0)
+    error = db.Column(db.String(), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    story_id = db.Column(db.Integer, db.ForeignKey('stories.id'), nullable=True)
+
+
 db.create_all()
+# Changes to tables that already exist are made once per deploy by `flask migrate` (the release phase), not here:
+# every gunicorn worker, the job worker and each CLI command import this module, and they would race each other
+pending_columns = missing_columns(db.engine, db.metadata.sorted_tables)
+if pending_columns:
+    print(f"Database is missing {', '.join(pending_columns)}, run `flask migrate`")
+search_index = SearchIndex(db)
+search_index.detect()
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", 50))
+bulk_loader = BulkLoader(db)
+translation_memory = TranslationMemory(db, bulk_loader)
+story_crawler = StoryCrawler()
+
+registry.gauge("hola_translation_cache_hit_ratio", "Hit ratio of the in-process translation cache",
+               lambda: translation_cache.stats()["hit_ratio"], aggregate="mean")
+registry.gauge("hola_translation_cache_size", "Entries in the in-process translation cache",
+               lambda: translation_cache.stats()["size"])
+registry.gauge("hola_translator_sessions_open", "Browser sessions open in the translator pool",
+               lambda: (translation_backend.pool_stats() or {}).get("open"))
+registry.gauge("hola_translator_sessions_idle", "Browser sessions waiting in the translator pool",
+               lambda: (translation_backend.pool_stats() or {}).get("idle"))
+registry.gauge("hola_translate_in_flight", "Requests waiting on the translator",
+               lambda: translate_limiter.stats()["in_flight"])
+registry.gauge("hola_translate_words_in_flight", "Distinct words being translated, however many requests wait on each",
+               lambda: translate_flights.stats()["in_flight"])
+registry.gauge("hola_db_pool_checked_out", "Database connections checked out of the pool",
+               lambda: pool_monitor.stats().get("checked_out"))
+registry.gauge("hola_db_pool_overflow", "Database connections open beyond the pool size",
+               lambda: pool_monitor.stats().get("overflow"))
+registry.gauge("hola_db_pool_checkout_wait_max_seconds", "Longest wait for a database connection",
+               lambda: pool_monitor.stats()["checkout_wait_max"], aggregate="max")
+
+# API KEYS
+# Registering or deleting an account stamps this in the shared cache so every worker picks the change up within
+# seconds, without a SHARED_CACHE_URL other workers only notice on their next API_KEY_INDEX_REFRESH
+API_KEYS_CHANGED = "api_keys:changed_at"
+api_key_index = ApiKeyIndex(loader=lambda: db.session.query(Consumer.key, Consumer.id).all(),
+                            changed_at=lambda: shared_cache.get(API_KEYS_CHANGED))
+api_key_index.refresh()
+# Buckets are per process: with N gunicorn workers a consumer can make up to N times RATE_LIMIT_PER_SECOND and
+# RATE_LIMIT_BURST, so set them to the per-consumer limit divided by the number of workers
+rate_limiter = RateLimiter()
+usage_meter = UsageMeter()
 
 
 # --------- FORMS --------- #
@@ -125,29 +268,338 @@ def send_validation_email():
                                 msg=message)
 
 
-def valid_api_key(headers):
+def api_consumer(headers):
+    # Returns "admin" for the admin key, the consumer's id for a consumer key and None otherwise
     try:
         key_from_header = headers['x-api-key']
-        if key_from_header == os.getenv("ADMIN_KEY"):
-            return True
+        admin_key = os.getenv("ADMIN_KEY")
+        if admin_key and hmac.compare_digest(key_from_header.encode("utf-8"), admin_key.encode("utf-8")):
+            return "admin"
         else:
-            return False
+            return api_key_index.lookup(key_from_header)
     except KeyError:
-        return False
+        return None
+
+
+def timed_api_consumer(headers):
+    with API_KEY_SECONDS.time():
+        return api_consumer(headers)
+
+
+def flush_usage():
+    usage = usage_meter.drain()
+    if not usage:
+        return
+    # Counts from last month are replaced rather than added to, which is the monthly rollover
+    month_start = datetime.utcnow().date().replace(day=1)
+    consumers = Consumer.__table__
+    statement = consumers.update().where(consumers.c.id == bindparam("consumer_id")).values(
+        requests_this_month=case(
+            [(or_(consumers.c.last_request.is_(None), consumers.c.last_request < month_start),
+              bindparam("request_count"))],
+            else_=db.func.coalesce(consumers.c.requests_this_month, 0) + bindparam("request_count")
+        ),
+        last_request=bindparam("request_date")
+    )
+    try:
+        with app.app_context():
+            db.session.execute(statement, [
+                {"consumer_id": consumer_id, "request_count": count, "request_date": last_request}
+                for consumer_id, count, last_request in usage
+            ])
+            db.session.commit()
+            db.session.remove()
+    except exc.SQLAlchemyError as e:
+        print(f"Error flushing usage: {e}")
+        usage_meter.restore(usage)
 
 
 def save_translation(es, en):
     try:
         new_word = Words()
-        new_word.es = es
+        new_word.es = clean(es)
         new_word.en = en
+        new_word.key = normalize(es)
 
         db.session.add(new_word)
         db.session.commit()
+        translation_cache.set(new_word.key, en)
     except exc.IntegrityError as e:
+        db.session.rollback()
         print(f"Error saving translation: {e}")
 
 
+def save_translations(translated_words):
+    new_words = {}
+    for es, en in translated_words:
+        if en is not None:
+            new_words.setdefault(normalize(es), Words(es=clean(es), en=en, key=normalize(es)))
+    new_words = list(new_words.values())
+    if not new_words:
+        return
+    try:
+        db.session.add_all(new_words)
+        db.session.commit()
+        for word in new_words:
+            translation_cache.set(word.key, word.en)
+    except exc.IntegrityError:
+        # Another request saved some of these first, fall back to one at a time
+        db.session.rollback()
+        for word in new_words:
+            save_translation(es=word.es, en=word.en)
+
+
+def translate_and_save(es):
+    cache_key = f"translate:{normalize(es)}"
+    cached = shared_cache.get(cache_key)
+    if cached is not None:
+        return cached["en"]
+
+    # Only one worker scrapes a given missing word, the rest wait for its result. If the holder fails without
+    # one, a waiter takes the lock over, and past TRANSLATE_LOCK_WAIT a waiter stops waiting and scrapes it itself.
+    deadline = time.monotonic() + TRANSLATE_LOCK_WAIT
+    locked = shared_cache.acquire_lock(cache_key, ttl=TRANSLATE_LOCK_TTL)
+    while not locked:
+        cached = shared_cache.wait_for(cache_key, timeout=max(0.0, deadline - time.monotonic()))
+        if cached is not None:
+            return cached["en"]
+        if time.monotonic() >= deadline:
+            break
+        locked = shared_cache.acquire_lock(cache_key, ttl=TRANSLATE_LOCK_TTL)
+    try:
+        en = translation_backend.translate(text=clean(es), title="Words")
+        if en is None:
+            shared_cache.set(cache_key, {"en": None}, ttl=NEGATIVE_CACHE_TTL)
+        else:
+            save_translation(es=es, en=en)
+            shared_cache.set(cache_key, {"en": en}, ttl=SHARED_CACHE_TTL)
+    finally:
+        if locked:
+            shared_cache.release_lock(cache_key)
+    return en
+
+
+def translate_within_limit(es):
+    with translate_limiter:
+        return translate_and_save(es)
+
+
+def translator_busy(reason):
+    TRANSLATE_REJECTED.inc(1, reason)
+    return "Translator busy, try again later", 503, {"Retry-After": str(translate_limiter.retry_after)}
+
+
+def story_changed(story_id):
+    db.session.query(Story).filter_by(id=story_id)\
+        .update({"version": Story.version + 1, "updated_at": datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    refresh_story_bundle(story_id)
+
+
+def refresh_story_bundle(story_id):
+    # Bundles live on local disk, so a web process that didn't make the change writes its own on first read
+    try:
+        story = Story.query.get(story_id)
+        if story is None:
+            file_manager.delete_story_bundles(story_id)
+        else:
+            file_manager.write_story_bundle(story.id, story.version, jsonify(response=story_response(story)).get_data())
+    except OSError as e:
+        print(f"Error writing bundle for story {story_id}: {e}")
+
+
+def conditional_response(response):
+    if not response.get_etag()[0]:
+        response.add_etag()
+    return response.make_conditional(request)
+
+
+def page_args(default_limit):
+    # Returns (limit, after_id), or (None, None) when the query string holds something that isn't a page
+    try:
+        limit = int(request.args.get('limit', default_limit or 0))
+        after_id = int(request.args.get('after_id', 0))
+    except ValueError:
+        return None, None
+    if limit < 0 or after_id < 0 or (default_limit and limit == 0):
+        return None, None
+    return min(limit, MAX_PAGE_SIZE) or None, after_id
+
+
+def stream_ndjson(query, row_to_dict, header=None):
+    # Rows come off a server-side cursor one at a time, nothing is loaded into ORM objects
+    def generate():
+        if header is not None:
+            yield json.dumps(header) + "\n"
+        connection = db.engine.connect().execution_options(stream_results=True)
+        try:
+            for row in connection.execute(query):
+                yield json.dumps(row_to_dict(row)) + "\n"
+        finally:
+            connection.close()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def requeue_stale_jobs():
+    # A job still "running" with no progress for JOB_LEASE_SECONDS lost its worker (dyno restart, crash),
+    # progress commits bump updated_at so live jobs keep renewing their lease
+    cutoff = datetime.utcnow() - timedelta(seconds=float(os.getenv("JOB_LEASE_SECONDS", 1800)))
+    requeued = db.session.query(Job).filter(Job.status == "running", Job.updated_at < cutoff)\
+        .update({"status": "queued", "updated_at": datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    if requeued:
+        print(f"Requeued {requeued} jobs abandoned by a worker")
+
+
+def claim_next_job():
+    while True:
+        job = db.session.query(Job).filter_by(status="queued").order_by(Job.id).first()
+        if job is None:
+            return None
+        # Only one worker wins the queued -> running transition for a given job
+        claimed = db.session.query(Job).filter_by(id=job.id, status="queued")\
+            .update({"status": "running", "updated_at": datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            db.session.refresh(job)
+            return job
+
+
+def process_story_job(job):
+    try:
+        story_title, story_paragraphs = StoryManager().fetch_story(story=job.payload)
+    except Exception as e:
+        print(f"Story job {job.id} failed: {e}")
+        job.status = "failed"
+        job.error = str(e)
+        db.session.commit()
+        return
+    ingest_story(job, story_title, story_paragraphs)
+
+
+def ingest_story(job, story_title, story_paragraphs):
+    try:
+        if db.session.query(Story.id).filter_by(title=story_title).first() is not None:
+            raise ValueError(f"A story titled {story_title} already exists")
+        job.paragraphs_total = len(story_paragraphs)
+        job.paragraphs_done = 0
+        db.session.commit()
+
+        # Paragraphs another story already has are reused whole, the rest are split into sentences and only
+        # sentences the translation memory has never seen go to the translator
+        translated_paragraphs = translation_memory.lookup_paragraphs(story_paragraphs)
+        STORY_SENTENCES.inc(sum(len(translation_memory.split(paragraph)) for paragraph in translated_paragraphs),
+                            "paragraphs")
+        paragraph_sentences = {paragraph: translation_memory.split(paragraph) for paragraph in story_paragraphs
+                               if paragraph not in translated_paragraphs}
+        sentences = {sentence for paragraph_sentences_list in paragraph_sentences.values()
+                     for sentence in paragraph_sentences_list}
+        translated_sentences = translation_memory.lookup(sentences)
+        missing_sentences = [sentence for sentence in sentences if sentence not in translated_sentences]
+        STORY_SENTENCES.inc(len(sentences) - len(missing_sentences), "memory")
+        STORY_SENTENCES.inc(len(missing_sentences), "translator")
+
+        remaining = {paragraph: {sentence for sentence in paragraph_sentences[paragraph]
+                                 if sentence not in translated_sentences} for paragraph in paragraph_sentences}
+        job.paragraphs_done = sum(1 for paragraph in story_paragraphs if not remaining.get(paragraph))
+        db.session.commit()
+
+        # Each worker thread borrows its own translator session, so keep this at or below TRANSLATOR_POOL_SIZE
+        max_workers = int(os.getenv("STORY_TRANSLATION_WORKERS", os.getenv("TRANSLATOR_POOL_SIZE", 2)))
+        new_sentences = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(translation_backend.translate, text=sentence, title=story_title): sentence
+                       for sentence in missing_sentences}
+            for future in as_completed(futures):
+                sentence = futures[future]
+                translated_sentences[sentence] = future.result()
+                new_sentences.append((sentence, translated_sentences[sentence]))
+                for paragraph, waiting in remaining.items():
+                    if sentence in waiting:
+                        waiting.discard(sentence)
+                        if not waiting:
+                            job.paragraphs_done += story_paragraphs.count(paragraph)
+                db.session.commit()
+        # Remembered even if the story fails below, so a retry doesn't translate them again
+        translation_memory.remember(new_sentences)
+        db.session.commit()
+
+        for paragraph, paragraph_sentences_list in paragraph_sentences.items():
+            translations = [translated_sentences.get(sentence) for sentence in paragraph_sentences_list]
+            if translations and None not in translations:
+                translated_paragraphs[paragraph] = " ".join(translations)
+        untranslated = [paragraph for paragraph in story_paragraphs if paragraph not in translated_paragraphs]
+        if untranslated:
+            raise ValueError(f"{len(untranslated)} paragraphs could not be translated")
+
+        # The story and its paragraphs are committed together, a failure never leaves an empty story behind
+        new_story = Story(title=story_title)
+        db.session.add(new_story)
+        db.session.flush()
+        db.session.bulk_insert_mappings(Paragraph, [
+            {"es": es, "en": translated_paragraphs[es], "story_id": new_story.id}
+            for es in story_paragraphs
+        ])
+        job.story_id = new_story.id
+        job.status = "done"
+        db.session.commit()
+        refresh_story_bundle(new_story.id)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Story job {job.id} failed: {e}")
+        job.status = "failed"
+        job.error = str(e)
+    db.session.commit()
+
+
+def process_crawl_job(job):
+    # For a crawl job paragraphs_total/paragraphs_done count the new stories found and ingested
+    try:
+        slugs = story_crawler.discover_slugs()
+        known_slugs = {row.payload for row in db.session.query(Job.payload)
+                       .filter(Job.kind == "story", Job.status != "failed", Job.payload.in_(slugs))} if slugs else set()
+        new_slugs = [slug for slug in slugs if slug not in known_slugs]
+        job.paragraphs_total = len(new_slugs)
+        db.session.commit()
+
+        for slug, fetched_story in story_crawler.fetch_stories(new_slugs):
+            if fetched_story is not None:
+                story_title, story_paragraphs = fetched_story
+                if db.session.query(Story.id).filter_by(title=story_title).first() is None:
+                    story_job = Job(kind="story", payload=slug, status="running")
+                    db.session.add(story_job)
+                    db.session.commit()
+                    ingest_story(story_job, story_title, story_paragraphs)
+            job.paragraphs_done += 1
+            db.session.commit()
+        job.status = "done"
+    except Exception as e:
+        db.session.rollback()
+        print(f"Crawl job {job.id} failed: {e}")
+        job.status = "failed"
+        job.error = str(e)
+    db.session.commit()
+
+
+def run_pending_jobs():
+    with app.app_context():
+        requeue_stale_jobs()
+        while True:
+            job = claim_next_job()
+            if job is None:
+                break
+            if job.kind == "story":
+                process_story_job(job)
+            elif job.kind == "crawl":
+                process_crawl_job(job)
+            else:
+                job.status = "failed"
+                job.error = f"Unknown job kind: {job.kind}"
+                db.session.commit()
+        db.session.remove()
+
+
 @login_manager.user_loader
 def user_loader(user_id):
     return db.session.query(Consumer).get(user_id)
@@ -163,6 +615,28 @@ def logged_in(f):
     return decorated_function
 
 
+def api_key_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        consumer = timed_api_consumer(request.headers)
+        if consumer is None:
+            return "API Key not found", 403
+        if consumer != "admin":
+            if not rate_limiter.allow(consumer):
+                return "Rate limit exceeded", 429, {"Retry-After": str(int(rate_limiter.retry_after(consumer)) + 1)}
+            usage_meter.record(consumer)
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def admin_page():
+    try:
+        return max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        return 1
+
+
 def admin_only(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -215,6 +689,8 @@ def register():
 
         db.session.add(new_consumer)
         db.session.commit()
+        api_key_index.add(new_consumer.key, new_consumer.id)
+        shared_cache.set(API_KEYS_CHANGED, time.time())
 
         login_user(new_consumer)
         return redirect(url_for("home"))
@@ -248,8 +724,11 @@ def confirm_delete():
 @logged_in
 def delete_account():
     user_to_delete = current_user
+    key_to_delete = user_to_delete.key
     db.session.delete(user_to_delete)
     db.session.commit()
+    api_key_index.remove(key_to_delete)
+    shared_cache.set(API_KEYS_CHANGED, time.time())
     logout_user()
     return redirect(url_for('home'))
 
@@ -286,17 +765,17 @@ def view_all_consumers():
 @app.route('/translations', methods=['GET', 'POST'])
 @admin_only
 def translations():
-    if request.method == 'POST':
-        search_text = request.form['text']
-        if search_text:
-            words = Words.query.filter(or_(Words.es.contains(search_text),
-                                           Words.en.contains(search_text)))
-            return render_template('translations.html', translations=words)
-        else:
-            return render_template('translations.html')
+    search_text = request.form['text'] if request.method == 'POST' else request.args.get('q')
+    if request.method == 'POST' and not search_text:
+        return render_template('translations.html')
+    page = admin_page()
+    offset = (page - 1) * ADMIN_PAGE_SIZE
+    if search_text:
+        words = search_index.search_words(search_text, limit=ADMIN_PAGE_SIZE + 1, offset=offset)
     else:
-        words = db.session.query(Words)
-        return render_template('translations.html', translations=words)
+        words = db.session.query(Words).order_by(Words.es).limit(ADMIN_PAGE_SIZE + 1).offset(offset).all()
+    return render_template('translations.html', translations=words[:ADMIN_PAGE_SIZE], search_text=search_text,
+                           page=page, has_next=len(words) > ADMIN_PAGE_SIZE)
 
 
 @app.route('/delete-translation')
@@ -305,8 +784,11 @@ def delete_translation():
     es = request.args.get('es')
     translation_to_delete = db.session.query(Words).filter_by(es=es).first()
     if translation_to_delete:
+        key = translation_to_delete.key or normalize(es)
         db.session.delete(translation_to_delete)
         db.session.commit()
+        translation_cache.invalidate(key)
+        shared_cache.delete(f"translate:{key}")
         return redirect(url_for('translations'))
     else:
         return "Cannot delete word", 403
@@ -321,6 +803,9 @@ def edit_translation():
     if form.validate_on_submit():
         translation_to_edit.en = form.english.data
         db.session.commit()
+        key = translation_to_edit.key or normalize(es)
+        translation_cache.invalidate(key)
+        shared_cache.delete(f"translate:{key}")
         return redirect(url_for('translations'))
     else:
         return render_template('edit-translation.html', spanish=translation_to_edit.es, form=form)
@@ -348,6 +833,7 @@ def edit_title():
             story_to_edit = Story.query.get(story_id)
             story_to_edit.title = form.title.data
             db.session.commit()
+            story_changed(story_id)
         else:
             new_story = Story(title=form.title.data)
             db.session.add(new_story)
@@ -364,16 +850,17 @@ def edit_title():
 @app.route('/stories', methods=['GET', 'POST'])
 @admin_only
 def stories():
-    if request.method == 'POST':
-        search_text = request.form['text']
-        if search_text:
-            titles = Story.query.filter(Story.title.contains(search_text)).all()
-            return render_template('stories.html', stories=titles)
-        else:
-            return render_template('stories.html')
+    search_text = request.form['text'] if request.method == 'POST' else request.args.get('q')
+    if request.method == 'POST' and not search_text:
+        return render_template('stories.html')
+    page = admin_page()
+    offset = (page - 1) * ADMIN_PAGE_SIZE
+    if search_text:
+        titles = search_index.search_stories(search_text, limit=ADMIN_PAGE_SIZE + 1, offset=offset)
     else:
-        all_stories = Story.query.all()
-        return render_template('stories.html', stories=all_stories)
+        titles = Story.query.order_by(Story.id).limit(ADMIN_PAGE_SIZE + 1).offset(offset).all()
+    return render_template('stories.html', stories=titles[:ADMIN_PAGE_SIZE], search_text=search_text,
+                           page=page, has_next=len(titles) > ADMIN_PAGE_SIZE)
 
 
 @app.route('/delete-story')
@@ -387,6 +874,7 @@ def delete_story():
         story_to_delete = Story.query.get(story_id)
         db.session.delete(story_to_delete)
         db.session.commit()
+        story_changed(story_id)
         return redirect(url_for('stories'))
     else:
         return "Story not found", 404
@@ -409,6 +897,7 @@ def edit_paragraph():
                 new_paragraph = Paragraph(es=form.spanish.data, en=form.english.data, story_id=story_id)
                 db.session.add(new_paragraph)
             db.session.commit()
+            story_changed(story_id)
             return redirect(url_for('edit_story', id=story_id))
         else:
             if paragraph_id:
@@ -421,6 +910,118 @@ def edit_paragraph():
 
 
 
+@app.route('/import', methods=['POST'])
+@admin_only
+def bulk_import():
+    kind = request.form.get('kind', 'words')
+    upload = request.files.get('file')
+    if upload is None:
+        return "No file uploaded", 400
+    file_format = request.form.get('format') or upload.filename.rsplit('.', 1)[-1].lower()
+    file = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+    try:
+        if kind == 'words' and file_format in ('csv', 'jsonl'):
+            read, inserted = bulk_loader.import_words(file, file_format)
+        elif kind == 'stories' and file_format == 'jsonl':
+            # A story's paragraphs are a nested list, which only JSON lines can hold
+            read, inserted = bulk_loader.import_stories(file, file_format)
+        else:
+            return "Unsupported kind or format", 400
+    except (ValueError, KeyError) as e:
+        return f"Could not import file: {e}", 400
+    return jsonify(response={"read": read, "inserted": inserted, "skipped": read - inserted})
+
+
+@app.route('/export')
+@admin_only
+def bulk_export():
+    kind = request.args.get('kind', 'words')
+    file_format = request.args.get('format', 'jsonl')
+    if kind == 'words' and file_format in ('csv', 'jsonl'):
+        lines = bulk_loader.export_words(file_format)
+    elif kind == 'stories' and file_format == 'jsonl':
+        lines = bulk_loader.export_stories()
+    else:
+        return "Unsupported kind or format", 400
+    mimetype = "text/csv" if file_format == 'csv' else "application/x-ndjson"
+    return Response(stream_with_context(lines), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={kind}.{file_format}"})
+
+
+@app.cli.command("migrate")
+def migrate_command():
+    add_missing_columns(db.engine, db.metadata.sorted_tables)
+    # Rows saved before words.key existed, duplicates that now share a key keep the row already in canonical form
+    backfill_column(db.engine, Words.__table__, Words.__table__.c.key, Words.__table__.c.es, normalize)
+    remove_duplicates(db.engine, Words.__table__, Words.__table__.c.key,
+                      keep=lambda rows: min(rows, key=lambda row: (row.es != row.key, len(row.es), row.es)))
+    create_missing_indexes(db.engine, db.metadata.sorted_tables)
+    drop_unique_constraints(db.engine, Paragraph.__table__)
+    search_index.create()
+    # Existing stories seed the translation memory, sentences it already holds are skipped
+    print(f"Remembered {translation_memory.seed_from_paragraphs()} sentences from saved stories")
+    print("Database is up to date")
+
+
+@app.cli.command("import-translations")
+@click.argument("path")
+@click.option("--format", "file_format", type=click.Choice(["csv", "jsonl"]), default=None)
+def import_translations_command(path, file_format):
+    with open(path, encoding="utf-8", newline="") as file:
+        read, inserted = bulk_loader.import_words(file, file_format or path.rsplit(".", 1)[-1].lower())
+    print(f"Read {read} translations, inserted {inserted}, skipped {read - inserted}")
+
+
+@app.cli.command("import-stories")
+@click.argument("path")
+def import_stories_command(path):
+    with open(path, encoding="utf-8") as file:
+        read, inserted = bulk_loader.import_stories(file)
+    print(f"Read {read} stories, inserted {inserted}, skipped {read - inserted}")
+
+
+@app.cli.command("export-translations")
+@click.argument("path")
+@click.option("--format", "file_format", type=click.Choice(["csv", "jsonl"]), default="jsonl")
+def export_translations_command(path, file_format):
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        file.writelines(bulk_loader.export_words(file_format))
+
+
+@app.cli.command("export-stories")
+@click.argument("path")
+def export_stories_command(path):
+    with open(path, "w", encoding="utf-8") as file:
+        file.writelines(bulk_loader.export_stories())
+
+
+@app.before_request
+def start_request_timer():
+    request.started_at = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    started_at = getattr(request, "started_at", None)
+    if started_at is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started_at, request.endpoint or "unknown", response.status_code)
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    if api_consumer(request.headers) != "admin":
+        return "API Key not found", 403
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/internal/pool')
+def pool_stats():
+    if api_consumer(request.headers) != "admin":
+        return "API Key not found", 403
+    return jsonify(response=pool_monitor.stats())
+
+
 @app.context_processor
 def inject_now():
     return {'now': datetime.utcnow()}
@@ -429,131 +1030,299 @@ def inject_now():
 # RESTful API routes
 # TODO delete the following as it is for quick testing only
 @app.route("/random")
+@api_key_required
 def random():
-    headers = request.headers
-    if valid_api_key(headers):
-        my_dict = {
-            "es": "Hola",
-            "en": "Hello"
-        }
-        return jsonify(response=my_dict)
-    else:
-        return "API Key not found", 403
+    my_dict = {
+        "es": "Hola",
+        "en": "Hello"
+    }
+    return jsonify(response=my_dict)
 
 
 @app.route("/translate")
+@api_key_required
 def translate():
-    global translator
-    headers = request.headers
-
-    if valid_api_key(headers):
-        es = request.args.get('es')
-        existing_translation = db.session.query(Words).filter_by(es=es).first()
-        if existing_translation:
-            return_dict = {
-                "en": existing_translation.en,
-                "es": existing_translation.es
-            }
-            return jsonify(response=return_dict)
-        elif es:
-            if not translator:
-                translator = SeleniumTranslationManger()
-            en = translator.translate(text=es, title="Words")
-            save_translation(es=es, en=en)
-            return_dict = {
-                "en": en,
-                "es": es
-            }
-            translator.close_webdriver()
-            translator = None
-            return jsonify(response=return_dict)
-        else:
-            return "No text to translate", 400
+    es = request.args.get('es')
+    # "Perro", " perro " and "perro." are all looked up, cached and translated as "perro"
+    key = normalize(es)
+    cached_en = translation_cache.get(key)
+    if cached_en is not None:
+        return_dict = {
+            "en": cached_en,
+            "es": es
+        }
+        return conditional_response(jsonify(response=return_dict))
+    with WORDS_LOOKUP_SECONDS.time():
+        existing_translation = db.session.query(Words).filter_by(key=key).first() if key else None
+    if existing_translation:
+        translation_cache.set(key, existing_translation.en)
+        return_dict = {
+            "en": existing_translation.en,
+            "es": es
+        }
+        return conditional_response(jsonify(response=return_dict))
+    elif key:
+        # Hand the lookup's pooled connection back before waiting on the translator, which can take
+        # TRANSLATOR_CHECKOUT_TIMEOUT + TRANSLATE_TIMEOUT; saving the result checks one out again briefly
+        db.session.close()
+        try:
+            en = translate_flights.do(key, lambda: translate_within_limit(es))
+        except InflightLimitExceeded:
+            return translator_busy("in_flight")
+        except FlightTimeout:
+            return translator_busy("flight_wait")
+        except TranslatorPoolExhausted:
+            return translator_busy("pool")
+        return_dict = {
+            "en": en,
+            "es": es
+        }
+        return jsonify(response=return_dict)
     else:
-        return "API Key not found", 403
+        return "No text to translate", 400
+
+
+@app.route("/translate/batch", methods=["POST"])
+@api_key_required
+def translate_batch():
+    words = request.get_json(silent=True)
+    if isinstance(words, dict):
+        words = words.get("es")
+    if not isinstance(words, list) or not all(isinstance(word, str) for word in words):
+        return "Expected a JSON list of words to translate", 400
+    if len(words) > int(os.getenv("TRANSLATE_BATCH_MAX_ITEMS", 500)):
+        return "Too many words in one batch", 400
+
+    # key -> the first word in the request with that key
+    unique_words = {}
+    for word in words:
+        key = normalize(word)
+        if key:
+            unique_words.setdefault(key, word)
+    translations = {}
+    for key in unique_words:
+        cached_en = translation_cache.get(key)
+        if cached_en is not None:
+            translations[key] = cached_en
+    uncached_keys = [key for key in unique_words if key not in translations]
+    if uncached_keys:
+        with WORDS_LOOKUP_SECONDS.time():
+            existing_translations = db.session.query(Words).filter(Words.key.in_(uncached_keys)).all()
+        for word in existing_translations:
+            translations[word.key] = word.en
+            translation_cache.set(word.key, word.en)
+
+    missing_keys = [key for key in unique_words if key not in translations]
+    if missing_keys:
+        missing_words = [unique_words[key] for key in missing_keys]
+        # Same as /translate, no pooled connection is held while the translator works
+        db.session.close()
+        try:
+            with translate_limiter:
+                translated = translation_backend.translate_batch(texts=[clean(word) for word in missing_words],
+                                                                 title="Words")
+        except InflightLimitExceeded:
+            return translator_busy("in_flight")
+        except TranslatorPoolExhausted:
+            return translator_busy("pool")
+        save_translations(list(zip(missing_words, translated)))
+        translations.update(zip(missing_keys, translated))
+
+    return_list = [{"es": word, "en": translations.get(normalize(word))} for word in words]
+    return jsonify(response=return_list)
 
 
 @app.route("/story")
+@api_key_required
 def story():
-    global translator
-    headers = request.headers
     title = request.args.get('title')
-    if valid_api_key(headers):
-        my_story = StoryManager().fetch_story(story=title)
-        story_title = my_story[0]
-        new_story = Story(title=story_title)
-        db.session.add(new_story)
-        db.session.commit()
-        story_id = new_story.id
-        story_paragraphs = my_story[1]
-        if not translator:
-            translator = SeleniumTranslationManger()
+    new_job = Job(kind="story", payload=title, status="queued")
+    db.session.add(new_job)
+    db.session.commit()
 
-            for paragraph in story_paragraphs:
-                new_paragraph = Paragraph(es=paragraph, en=translator.translate(text=paragraph, title=story_title), story_id=story_id)
-                db.session.add(new_paragraph)
-                print("translating paragraph")
-            db.session.commit()
-            translator.close_webdriver()
+    return_value = {
+        "job_id": new_job.id,
+        "status": new_job.status
+    }
+    return jsonify(response=return_value), 202
 
-            file_manager = FileManager()
-            print(file_manager.return_story(story_title))
 
-            return_value = {
-                "story-title": f"{story_title}"
-            }
-            return jsonify(response=return_value)
-        else:
-            return "API Key not found", 403
+@app.route("/crawl")
+@api_key_required
+def crawl():
+    if api_consumer(request.headers) != "admin":
+        return "Crawling needs the admin key", 403
+    new_job = Job(kind="crawl", status="queued")
+    db.session.add(new_job)
+    db.session.commit()
+
+    return_value = {
+        "job_id": new_job.id,
+        "status": new_job.status
+    }
+    return jsonify(response=return_value), 202
+
+
+@app.route("/jobs/<int:job_id>")
+@api_key_required
+def job_status(job_id):
+    job = db.session.query(Job).get(job_id)
+    if job is None:
+        return "Job not found", 404
+
+    return_value = {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "story_id": job.story_id,
+        "paragraphs_total": job.paragraphs_total,
+        "paragraphs_done": job.paragraphs_done,
+        "error": job.error
+    }
+    return jsonify(response=return_value)
 
 
 @app.route('/all-stories')
+@api_key_required
 def all_stories():
-    headers = request.headers
+    limit, after_id = page_args(default_limit=PAGE_SIZE)
+    if limit is None:
+        return "limit and after_id must be positive whole numbers", 400
 
-    if valid_api_key(headers):
-        stories_to_return = []
-        stories_from_db = Story.query.all()
+    stories_table = Story.__table__
+    query = db.select([stories_table.c.id, stories_table.c.title])\
+        .where(stories_table.c.id > after_id).order_by(stories_table.c.id)
 
-        for title in stories_from_db:
-            stories_to_return.append({
-                "id": title.id,
-                "title": title.title
-            })
+    if request.args.get('format') == 'ndjson':
+        return stream_ndjson(query.limit(limit) if 'limit' in request.args else query,
+                             lambda row: {"id": row.id, "title": row.title})
 
-        return_value = {
-            "stories": stories_to_return
-        }
-        return jsonify(response=return_value)
-    else:
-        return "API Key not found", 403
+    rows = db.session.execute(query.limit(limit + 1)).fetchall()
+    stories_to_return = [{"id": row.id, "title": row.title} for row in rows[:limit]]
+
+    return_value = {
+        "stories": stories_to_return,
+        "next_after_id": stories_to_return[-1]["id"] if len(rows) > limit else None
+    }
+    return conditional_response(jsonify(response=return_value))
 
 
 @app.route('/fetch-story')
+@api_key_required
 def fetch_story():
-    headers = request.headers
-
-    if valid_api_key(headers):
-        story_id = request.args.get('id')
-        story_to_return = Story.query.get(story_id)
-        paragraphs = Paragraph.query.filter(Paragraph.story_id == story_to_return.id).order_by(Paragraph.id).all()
-        paragraphs_to_return = []
-
-        for paragraph in paragraphs:
-            paragraphs_to_return.append({
-                "id": paragraph.id,
-                "es": paragraph.es,
-                "en": paragraph.en
-            })
+    story_id = request.args.get('id')
+    # A story is small enough to send whole, pages are only used when the client asks for them
+    paginated = 'limit' in request.args or 'after_id' in request.args
+    streamed = request.args.get('format') == 'ndjson'
+    limit, after_id = page_args(default_limit=None)
+    if after_id is None:
+        return "limit and after_id must be positive whole numbers", 400
+
+    story_to_return = Story.query.get(story_id) if story_id else None
+    if story_to_return is None:
+        return "Story not found", 404
 
+    if not paginated and not streamed:
+        if "gzip" in request.accept_encodings:
+            response = story_bundle_response(story_to_return)
+            if response is not None:
+                return response.make_conditional(request)
+        response_key = (story_to_return.id, story_to_return.version)
+        body = story_response_cache.get(response_key)
+        if body is None:
+            return_value = story_response(story_to_return)
+            body = jsonify(response=return_value).get_data()
+            story_response_cache.set(response_key, body)
+        response = Response(body, mimetype="application/json")
+        response.set_etag(f"story-{story_to_return.id}-v{story_to_return.version}")
+        response.last_modified = story_to_return.updated_at
+        response.vary.add("Accept-Encoding")
+        return response.make_conditional(request)
+
+    paragraphs_table = Paragraph.__table__
+    query = db.select([paragraphs_table.c.id, paragraphs_table.c.es, paragraphs_table.c.en])\
+        .where(paragraphs_table.c.story_id == story_to_return.id).where(paragraphs_table.c.id > after_id)\
+        .order_by(paragraphs_table.c.id)
+
+    if streamed:
+        header = {"story_id": story_to_return.id, "story_title": story_to_return.title}
+        return stream_ndjson(query.limit(limit) if limit else query,
+                             lambda row: {"id": row.id, "es": row.es, "en": row.en}, header=header)
+
+    rows = db.session.execute(query.limit(limit + 1) if limit else query).fetchall()
+    paragraphs_to_return = [{"id": row.id, "es": row.es, "en": row.en} for row in rows[:limit]]
+
+    return_value = {
+        "story_id": story_to_return.id,
+        "story_title": story_to_return.title,
+        "paragraphs": paragraphs_to_return,
+        "next_after_id": paragraphs_to_return[-1]["id"] if limit and len(rows) > limit else None
+    }
+    response = jsonify(response=return_value)
+    response.set_etag(f"story-{story_to_return.id}-v{story_to_return.version}-{after_id}-{limit or 0}")
+    response.last_modified = story_to_return.updated_at
+    return response.make_conditional(request)
+
+
+def story_bundle_response(story):
+    path = file_manager.story_bundle(story.id, story.version)
+    if path is None:
+        try:
+            path = file_manager.write_story_bundle(story.id, story.version,
+                                                   jsonify(response=story_response(story)).get_data())
+        except OSError as e:
+            print(f"Error writing bundle for story {story.id}: {e}")
+            return None
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        # Replaced by a newer version between the lookup and the open
+        return None
+    # The already-compressed file goes out through the server's file wrapper (sendfile under gunicorn)
+    response = Response(wrap_file(request.environ, file), mimetype="application/json", direct_passthrough=True)
+    response.content_length = os.fstat(file.fileno()).st_size
+    response.content_encoding = "gzip"
+    response.vary.add("Accept-Encoding")
+    response.set_etag(f"story-{story.id}-v{story.version}-gzip")
+    response.last_modified = story.updated_at
+    return response
+
+
+def story_response(story_to_return):
+    cache_key = f"story:{story_to_return.id}:v{story_to_return.version}"
+    return_value = shared_cache.get(cache_key)
+    if return_value is None:
+        paragraphs = db.session.query(Paragraph.id, Paragraph.es, Paragraph.en)\
+            .filter(Paragraph.story_id == story_to_return.id).order_by(Paragraph.id).all()
         return_value = {
             "story_id": story_to_return.id,
             "story_title": story_to_return.title,
-            "paragraphs": paragraphs_to_return
+            "paragraphs": [{"id": paragraph.id, "es": paragraph.es, "en": paragraph.en} for paragraph in paragraphs]
         }
-        return jsonify(response=return_value)
-    else:
-        return "API Key not found", 403
+        shared_cache.set(cache_key, return_value, ttl=SHARED_CACHE_TTL)
+    return return_value
+
+
+usage_scheduler = BackgroundScheduler()
+usage_scheduler.add_job(flush_usage, "interval", seconds=float(os.getenv("USAGE_FLUSH_INTERVAL", 60)),
+                        max_instances=1, coalesce=True)
+if registry.directory:
+    # Other workers answer scrapes from these snapshots, see metrics.Registry
+    usage_scheduler.add_job(registry.write_snapshot, "interval",
+                            seconds=float(os.getenv("METRICS_SNAPSHOT_INTERVAL", 10)), max_instances=1, coalesce=True)
+    atexit.register(registry.write_snapshot)
+usage_scheduler.start()
+atexit.register(flush_usage)
+atexit.register(usage_scheduler.shutdown)
+
+
+# Local development can run the story queue inside the web process instead of a separate worker (see worker.py)
+if os.getenv("RUN_JOBS_IN_WEB"):
+    job_scheduler = BackgroundScheduler()
+    job_scheduler.add_job(run_pending_jobs, "interval", seconds=float(os.getenv("JOB_POLL_INTERVAL", 2)),
+                          max_instances=1, coalesce=True)
+    job_scheduler.start()
+    atexit.register(job_scheduler.shutdown)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,240 @@
+from contextlib import contextmanager
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # label values -> [bucket counts..., count, sum]
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = [0] * (len(self.buckets) + 1) + [0.0]
+                self.series[label_values] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def snapshot(self):
+        with self.lock:
+            return {label_values: list(values) for label_values, values in self.series.items()}
+
+    def merge(self, snapshots):
+        merged = {}
+        for snapshot in snapshots:
+            for label_values, values in snapshot.items():
+                total = merged.setdefault(label_values, [0] * len(values))
+                merged[label_values] = [a + b for a, b in zip(total, values)]
+        return merged
+
+    def render(self, series=None):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        if series is None:
+            series = self.snapshot()
+        for label_values, values in series.items():
+            for i, bound in enumerate(self.buckets):
+                labels = format_labels(self.label_names, label_values, ("le", bound))
+                lines.append(f"{self.name}_bucket{labels} {values[i]}")
+            labels = format_labels(self.label_names, label_values, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {values[-2]}")
+            labels = format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_count{labels} {values[-2]}")
+            lines.append(f"{self.name}_sum{labels} {values[-1]}")
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.series)
+
+    def merge(self, snapshots):
+        merged = {}
+        for snapshot in snapshots:
+            for label_values, value in snapshot.items():
+                merged[label_values] = merged.get(label_values, 0) + value
+        return merged
+
+    def render(self, series=None):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        if series is None:
+            series = self.snapshot()
+        for label_values, value in series.items():
+            lines.append(f"{self.name}{format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Gauge:
+    # Read when the metrics are scraped, so it always reports the current value of whatever it watches.
+    # Across workers the live workers' values are combined with `aggregate`: "sum", "max" or "mean".
+
+    def __init__(self, name, description, function, aggregate="sum"):
+        self.name = name
+        self.description = description
+        self.function = function
+        self.aggregate = aggregate
+
+    def snapshot(self):
+        try:
+            return self.function()
+        except Exception as e:
+            print(f"Error reading gauge {self.name}: {e}")
+            return None
+
+    def merge(self, snapshots):
+        values = [value for value in snapshots if value is not None]
+        if not values:
+            return None
+        if self.aggregate == "max":
+            return max(values)
+        if self.aggregate == "mean":
+            return sum(values) / len(values)
+        return sum(values)
+
+    def render(self, value=None):
+        if value is None:
+            value = self.snapshot()
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    # Each gunicorn worker keeps its own registry and a scrape reaches just one of them. With a directory set,
+    # every worker writes a snapshot there and whichever worker is scraped renders the sum of all of them
+    # (counters and histograms of exited workers are kept, so totals never go backwards; gauges count only
+    # live workers). Without one /metrics only shows the worker that answered, which is fine with one worker.
+
+    def __init__(self, directory=None):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.directory = directory if directory is not None else os.getenv("METRICS_DIR")
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, description, label_names, buckets))
+
+    def counter(self, name, description, label_names=()):
+        return self.register(Counter(name, description, label_names))
+
+    def gauge(self, name, description, function, aggregate="sum"):
+        return self.register(Gauge(name, description, function, aggregate))
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def write_snapshot(self):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        encoded = {}
+        for name, snapshot in self.snapshot().items():
+            if isinstance(snapshot, dict):
+                snapshot = [[list(label_values), values] for label_values, values in snapshot.items()]
+            encoded[name] = snapshot
+        # Renamed into place so a scrape never reads half a file
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(file_descriptor, "w") as file:
+            json.dump(encoded, file)
+        os.replace(temporary_path, os.path.join(self.directory, f"{os.getpid()}.json"))
+
+    def read_snapshots(self):
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            pid = int(os.path.basename(path)[:-len(".json")])
+            try:
+                with open(path) as file:
+                    encoded = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Error reading metrics snapshot {path}: {e}")
+                continue
+            decoded = {}
+            for name, snapshot in encoded.items():
+                if isinstance(snapshot, list):
+                    snapshot = {tuple(label_values): values for label_values, values in snapshot}
+                decoded[name] = snapshot
+            snapshots.append((pid, decoded))
+        return snapshots
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        if not self.directory:
+            for metric in metrics:
+                lines.extend(metric.render())
+            return "\n".join(lines) + "\n"
+
+        self.write_snapshot()
+        snapshots = self.read_snapshots()
+        for metric in metrics:
+            if isinstance(metric, Gauge):
+                values = [snapshot.get(metric.name) for pid, snapshot in snapshots if process_alive(pid)]
+            else:
+                values = [snapshot[metric.name] for pid, snapshot in snapshots if metric.name in snapshot]
+            lines.extend(metric.render(metric.merge(values)))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
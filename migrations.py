@@ -0,0 +1,109 @@
+from sqlalchemy import UniqueConstraint, bindparam, func, inspect, select
+
+
+def missing_columns(engine, tables):
+    # "table.column" for every model column an existing table doesn't have yet
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    missing = []
+    for table in tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        missing.extend(f"{table.name}.{column.name}" for column in table.columns if column.name not in existing_columns)
+    return missing
+
+
+def add_missing_columns(engine, tables):
+    # db.create_all() only creates missing tables, so columns added to an existing model are added here.
+    # New columns must be nullable or carry a server_default for this to work on a table that already has rows.
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    for table in tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            statement = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            if column.server_default is not None:
+                statement += f" DEFAULT {column.server_default.arg}"
+            print(f"Adding column {table.name}.{column.name}")
+            engine.execute(statement)
+
+
+def create_missing_indexes(engine, tables):
+    # Indexes declared on columns that add_missing_columns added to an existing table
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    for table in tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                print(f"Creating index {index.name}")
+                index.create(engine)
+
+
+def backfill_column(engine, table, column, source_column, function, batch_size=1000):
+    # Fills column with function(source_column) on every row where it is still NULL
+    primary_key = list(table.primary_key.columns)[0]
+    rows = engine.execute(select([primary_key.label("row_id"), source_column.label("source")])
+                          .where(column.is_(None))).fetchall()
+    if not rows:
+        return 0
+    print(f"Backfilling {table.name}.{column.name} on {len(rows)} rows")
+    statement = table.update().where(primary_key == bindparam("row_id")).values({column.name: bindparam("value")})
+    with engine.begin() as connection:
+        for i in range(0, len(rows), batch_size):
+            connection.execute(statement, [{"row_id": row.row_id, "value": function(row.source)}
+                                           for row in rows[i:i + batch_size]])
+    return len(rows)
+
+
+def remove_duplicates(engine, table, column, keep):
+    # Leaves one row per value of column, keep(rows) picks the row that stays
+    primary_key = list(table.primary_key.columns)[0]
+    duplicated = [row[0] for row in engine.execute(
+        select([column]).where(column.isnot(None)).group_by(column).having(func.count() > 1))]
+    removed = 0
+    with engine.begin() as connection:
+        for value in duplicated:
+            rows = connection.execute(select([table]).where(column == value)).fetchall()
+            kept = keep(rows)
+            doomed = [row[primary_key.name] for row in rows if row[primary_key.name] != kept[primary_key.name]]
+            connection.execute(table.delete().where(primary_key.in_(doomed)))
+            removed += len(doomed)
+    if removed:
+        print(f"Removed {removed} duplicate rows from {table.name}")
+    return removed
+
+
+def drop_unique_constraints(engine, table):
+    # Drops unique constraints the database still has on columns the model no longer declares unique
+    inspector = inspect(engine)
+    if table.name not in inspector.get_table_names():
+        return
+    declared = {tuple(column.name for column in constraint.columns) for constraint in table.constraints
+                if isinstance(constraint, UniqueConstraint)}
+    declared |= {(column.name,) for column in table.columns if column.unique}
+    stale = [constraint for constraint in inspector.get_unique_constraints(table.name)
+             if tuple(constraint["column_names"]) not in declared]
+    if not stale:
+        return
+    print(f"Dropping unique constraints on {table.name}: {[constraint['column_names'] for constraint in stale]}")
+    if engine.dialect.name == "sqlite":
+        # SQLite can't drop a constraint, the table is rebuilt from the model and the rows copied across
+        columns = ", ".join(column.name for column in table.columns)
+        with engine.begin() as connection:
+            connection.execute(f"ALTER TABLE {table.name} RENAME TO {table.name}_old")
+            table.create(connection)
+            connection.execute(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_old")
+            connection.execute(f"DROP TABLE {table.name}_old")
+    else:
+        with engine.begin() as connection:
+            for constraint in stale:
+                connection.execute(f"ALTER TABLE {table.name} DROP CONSTRAINT {constraint['name']}")
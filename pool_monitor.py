@@ -0,0 +1,87 @@
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+import threading
+import time
+
+
+class PoolMonitor:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engine = None
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+
+    def pool_class(self):
+        # A QueuePool that times every checkout, including any pre-ping, and counts checkouts that timed out
+        monitor = self
+
+        class MonitoredQueuePool(QueuePool):
+
+            def connect(self):
+                return monitor.timed_checkout(super().connect)
+
+            def unique_connection(self):
+                return monitor.timed_checkout(super().unique_connection)
+
+        return MonitoredQueuePool
+
+    def timed_checkout(self, checkout):
+        start = time.perf_counter()
+        try:
+            return checkout()
+        except PoolTimeoutError:
+            self.record_timeout()
+            raise
+        finally:
+            self.record_checkout(time.perf_counter() - start)
+
+    def attach(self, engine):
+        self.engine = engine
+        event.listen(engine, "connect", self.on_connect)
+        event.listen(engine, "invalidate", self.on_invalidate)
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.connects += 1
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.invalidations += 1
+
+    def record_checkout(self, wait):
+        with self.lock:
+            self.checkouts += 1
+            self.checkout_wait_total += wait
+            self.checkout_wait_max = max(self.checkout_wait_max, wait)
+
+    def record_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def stats(self):
+        pool = self.engine.pool if self.engine is not None else None
+        with self.lock:
+            stats = {
+                "pool_class": type(pool).__name__ if pool is not None else None,
+                "checkouts": self.checkouts,
+                "checkout_wait_avg": self.checkout_wait_total / self.checkouts if self.checkouts else 0.0,
+                "checkout_wait_max": self.checkout_wait_max,
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations
+            }
+        # Only queue pools keep these counts, SQLite runs on a NullPool or SingletonThreadPool
+        if isinstance(pool, QueuePool):
+            stats.update({
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow()
+            })
+        return stats
@@ -0,0 +1,30 @@
+import os
+import threading
+import time
+
+
+class RateLimiter:
+
+    def __init__(self, rate=None, burst=None):
+        # Token bucket per API key: refills at `rate` requests a second and holds at most `burst` tokens.
+        # Buckets live in this process only, every gunicorn worker enforces its own.
+        self.rate = rate or float(os.getenv("RATE_LIMIT_PER_SECOND", 5))
+        self.burst = burst or float(os.getenv("RATE_LIMIT_BURST", 20))
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return True
+            self.buckets[key] = (tokens, now)
+            return False
+
+    def retry_after(self, key):
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.burst, time.monotonic()))
+        return max(0.0, (1 - tokens) / self.rate)
@@ -0,0 +1,154 @@
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from text_normalization import normalize
+import re
+
+
+class SearchIndex:
+    # SQLite gets FTS5 tables kept in sync by triggers, Postgres gets trigram indexes over unaccented text.
+    # Both are maintained by the database itself, so saves, edits and deletes need no extra calls from the routes.
+
+    def __init__(self, db):
+        self.db = db
+        self.dialect = db.engine.dialect.name
+        self.enabled = False
+
+    def detect(self):
+        # Run at import in every process, so it only looks: the index itself is built once by `flask migrate`
+        connection = self.db.engine.connect()
+        try:
+            if self.dialect == "sqlite":
+                self.enabled = self.exists_sqlite(connection)
+            elif self.dialect == "postgresql":
+                self.enabled = self.exists_postgres(connection)
+        except (OperationalError, ProgrammingError) as e:
+            print(f"Could not check for the search index: {e}")
+            self.enabled = False
+        finally:
+            connection.close()
+        if not self.enabled and self.dialect in ("sqlite", "postgresql"):
+            print("Search index not built, run `flask migrate`, searches use LIKE scans until then")
+        return self.enabled
+
+    def exists_sqlite(self, connection):
+        names = {row.name for row in connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE name IN ('words_fts', 'stories_fts', "
+            "'words_fts_insert', 'words_fts_delete', 'words_fts_update', "
+            "'stories_fts_insert', 'stories_fts_delete', 'stories_fts_update')"))}
+        return len(names) == 8
+
+    def exists_postgres(self, connection):
+        indexes = connection.execute(text(
+            "SELECT count(*) FROM pg_indexes WHERE indexname IN ('words_es_search', 'words_en_search', "
+            "'stories_title_search')")).scalar()
+        function = connection.execute(text("SELECT 1 FROM pg_proc WHERE proname = 'f_unaccent'")).first()
+        return indexes == 3 and function is not None
+
+    def create(self):
+        try:
+            if self.dialect == "sqlite":
+                self.create_sqlite()
+            elif self.dialect == "postgresql":
+                self.create_postgres()
+            else:
+                return
+            self.enabled = True
+        except (OperationalError, ProgrammingError) as e:
+            # Missing FTS5 or extension rights, search falls back to LIKE scans
+            self.db.session.rollback()
+            print(f"Search index not available: {e}")
+
+    def create_sqlite(self):
+        connection = self.db.engine.connect()
+        try:
+            for table, columns in (("words", ("es", "en")), ("stories", ("title",))):
+                fts_table = f"{table}_fts"
+                exists = connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                                            {"name": fts_table}).first()
+                column_list = ", ".join(columns)
+                new_values = ", ".join(f"new.{column}" for column in columns)
+                old_values = ", ".join(f"old.{column}" for column in columns)
+                connection.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5({column_list}, "
+                                   f"content='{table}', content_rowid='rowid', "
+                                   f"tokenize='unicode61 remove_diacritics 2')")
+                connection.execute(f"CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON {table} BEGIN "
+                                   f"INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.rowid, {new_values}); END")
+                connection.execute(f"CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON {table} BEGIN "
+                                   f"INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) "
+                                   f"VALUES ('delete', old.rowid, {old_values}); END")
+                connection.execute(f"CREATE TRIGGER IF NOT EXISTS {fts_table}_update AFTER UPDATE ON {table} BEGIN "
+                                   f"INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) "
+                                   f"VALUES ('delete', old.rowid, {old_values}); "
+                                   f"INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.rowid, {new_values}); END")
+                if not exists:
+                    print(f"Building search index {fts_table}")
+                    connection.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+        finally:
+            connection.close()
+
+    def create_postgres(self):
+        connection = self.db.engine.connect()
+        try:
+            connection.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            connection.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+            # unaccent() is only STABLE, an IMMUTABLE wrapper is needed before it can be used in an index
+            connection.execute("CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS "
+                               "$$ SELECT public.unaccent('public.unaccent', $1) $$ "
+                               "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT")
+            for table, column in (("words", "es"), ("words", "en"), ("stories", "title")):
+                connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_{column}_search ON {table} "
+                                   f"USING gin (f_unaccent(lower({column})) gin_trgm_ops)")
+        finally:
+            connection.close()
+
+    def match_query(self, search_text):
+        # Every word the user typed must appear as a word prefix, accents and case are ignored by the tokenizer
+        terms = re.findall(r"\w+", search_text)
+        return " ".join(f'"{term}"*' for term in terms)
+
+    def search_words(self, search_text, limit, offset=0):
+        if self.enabled and self.dialect == "sqlite":
+            match = self.match_query(search_text)
+            if not match:
+                return []
+            return self.db.session.execute(text(
+                "SELECT words.es, words.en FROM words_fts JOIN words ON words.rowid = words_fts.rowid "
+                "WHERE words_fts MATCH :match ORDER BY bm25(words_fts), words.es LIMIT :limit OFFSET :offset"),
+                {"match": match, "limit": limit, "offset": offset}).fetchall()
+        elif self.enabled and self.dialect == "postgresql":
+            return self.db.session.execute(text(
+                "SELECT es, en FROM words "
+                "WHERE f_unaccent(lower(es)) LIKE '%' || f_unaccent(lower(:pattern)) || '%' "
+                "OR f_unaccent(lower(en)) LIKE '%' || f_unaccent(lower(:pattern)) || '%' "
+                "ORDER BY greatest(similarity(f_unaccent(lower(es)), f_unaccent(lower(:q))), "
+                "similarity(f_unaccent(lower(en)), f_unaccent(lower(:q)))) DESC, es "
+                "LIMIT :limit OFFSET :offset"),
+                {"q": search_text, "pattern": self.escape_like(search_text), "limit": limit, "offset": offset}).fetchall()
+        return self.db.session.execute(text(
+            "SELECT es, en FROM words WHERE key LIKE :key_pattern OR en LIKE :pattern "
+            "ORDER BY es LIMIT :limit OFFSET :offset"),
+            {"key_pattern": f"%{normalize(search_text)}%", "pattern": f"%{search_text}%",
+             "limit": limit, "offset": offset}).fetchall()
+
+    def search_stories(self, search_text, limit, offset=0):
+        if self.enabled and self.dialect == "sqlite":
+            match = self.match_query(search_text)
+            if not match:
+                return []
+            return self.db.session.execute(text(
+                "SELECT stories.id, stories.title FROM stories_fts JOIN stories ON stories.id = stories_fts.rowid "
+                "WHERE stories_fts MATCH :match ORDER BY bm25(stories_fts), stories.id LIMIT :limit OFFSET :offset"),
+                {"match": match, "limit": limit, "offset": offset}).fetchall()
+        elif self.enabled and self.dialect == "postgresql":
+            return self.db.session.execute(text(
+                "SELECT id, title FROM stories "
+                "WHERE f_unaccent(lower(title)) LIKE '%' || f_unaccent(lower(:pattern)) || '%' "
+                "ORDER BY similarity(f_unaccent(lower(title)), f_unaccent(lower(:q))) DESC, id "
+                "LIMIT :limit OFFSET :offset"),
+                {"q": search_text, "pattern": self.escape_like(search_text), "limit": limit, "offset": offset}).fetchall()
+        return self.db.session.execute(text(
+            "SELECT id, title FROM stories WHERE title LIKE :pattern ORDER BY id LIMIT :limit OFFSET :offset"),
+            {"pattern": f"%{search_text}%", "limit": limit, "offset": offset}).fetchall()
+
+    def escape_like(self, search_text):
+        return search_text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
@@ -1,9 +1,22 @@
 from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException
-import time
-from file_manager import FileManager
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, TimeoutException, \
+    WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
+from metrics import registry
 import os
 
+ORIGINAL_TEXT_XPATH = '//*[@id="yDmH0d"]/c-wiz/div/div[2]/c-wiz/div[2]/c-wiz/div[1]/div[2]/div[2]/c-wiz[1]/span/span/div/textarea'
+TRANSLATED_TEXT_XPATH = '//*[@id="yDmH0d"]/c-wiz/div/div[2]/c-wiz/div[2]/c-wiz/div[1]/div[2]/div[2]/c-wiz[2]/div[' \
+                        '5]/div/div[3]/div[1]/div/div[1]/div[1]/textarea'
+
+TRANSLATE_SECONDS = registry.histogram("hola_selenium_translate_seconds",
+                                       "Time spent translating one text in the browser, by stage", ("stage",))
+WEBDRIVER_STARTUP_SECONDS = registry.histogram("hola_webdriver_startup_seconds", "Time taken to start a web driver")
+TRANSLATE_TIMEOUTS = registry.counter("hola_selenium_translate_timeouts_total",
+                                      "Translations abandoned after TRANSLATE_TIMEOUT")
+
 
 class SeleniumTranslationManger:
 
@@ -14,46 +27,64 @@ class SeleniumTranslationManger:
         self.options.add_argument("--disable-dev-shm-usage")
         self.options.add_argument("--no-sandbox")
         self.chrome_driver_path = os.getenv("CHROME_DRIVER_PATH")
+        self.timeout = float(os.getenv("TRANSLATE_TIMEOUT", 5))
+        self.poll_interval = float(os.getenv("TRANSLATE_POLL_INTERVAL", 0.1))
         self.driver = None
-        self.file_manager = FileManager()
+        self.uses = 0
 
     def translate(self, text, title):
-        # The below is only used where we are saving translations to file (rather than database)
+        with TRANSLATE_SECONDS.time("total"):
+            return self.translate_in_browser(text, title)
 
-        # existing_translation = self.file_manager.check_for_existing_translation(text, title)
-        # if existing_translation is not None:
-        #     print("we already have it!")
-        #     return existing_translation
+    def translate_in_browser(self, text, title):
         if not self.driver:
             print("I'm initialising the web driver")
             self.initialise_webdriver()
-        self.driver.get(url=f"https://translate.google.com/?sl=es&tl=en&op=translate")
-
-        original_text_element = self.driver.find_element_by_xpath(
-            '//*[@id="yDmH0d"]/c-wiz/div/div[2]/c-wiz/div[2]/c-wiz/div[1]/div[2]/div[2]/c-wiz[1]/span/span/div/textarea')
-        original_text_element.send_keys(text)
+        with TRANSLATE_SECONDS.time("page_load"):
+            self.driver.get(url=f"https://translate.google.com/?sl=es&tl=en&op=translate")
 
-        waiting_for_text = True
-        timeout = time.time() + 5
+        wait = WebDriverWait(self.driver, self.timeout, poll_frequency=self.poll_interval,
+                             ignored_exceptions=[NoSuchElementException, StaleElementReferenceException])
+        try:
+            original_text_element = wait.until(
+                expected_conditions.presence_of_element_located((By.XPATH, ORIGINAL_TEXT_XPATH)))
+            # Whatever is in the output box before we type is not our translation, so wait for it to change
+            previous_text = self.current_translation()
+            original_text_element.send_keys(text)
+            with TRANSLATE_SECONDS.time("wait"):
+                translated_text = wait.until(lambda driver: self.new_translation(previous_text))
+        except TimeoutException:
+            TRANSLATE_TIMEOUTS.inc()
+            print(f"Timed out after {self.timeout} seconds waiting for a translation of: {text}")
+            return None
+        print(f"I've got a translation, which is... {translated_text}")
+        return translated_text
 
-        while waiting_for_text and time.time() < timeout:
-            try:
-                translated_text = self.driver.find_element_by_xpath(
-                    '//*[@id="yDmH0d"]/c-wiz/div/div[2]/c-wiz/div[2]/c-wiz/div[1]/div[2]/div[2]/c-wiz[2]/div['
-                    '5]/div/div[3]/div[1]/div/div[1]/div[1]/textarea').get_attribute("data-initial-value")
-                print(f"I've got a translation, which is... {translated_text}")
+    def current_translation(self):
+        try:
+            return self.driver.find_element_by_xpath(TRANSLATED_TEXT_XPATH).get_attribute("data-initial-value")
+        except (NoSuchElementException, StaleElementReferenceException):
+            return None
 
-                # The below is only used where we are saving translations to file (rather than database)
-
-                # self.file_manager.save_new_translation((text, translated_text), title)
-                return translated_text
-            except NoSuchElementException:
-                pass
-        return None
+    def new_translation(self, previous_text):
+        translated_text = self.driver.find_element_by_xpath(TRANSLATED_TEXT_XPATH).get_attribute("data-initial-value")
+        if translated_text and translated_text != previous_text:
+            return translated_text
+        return False
 
     def initialise_webdriver(self):
         if self.driver is None:
-            self.driver = webdriver.Chrome(chrome_options=self.options, executable_path=self.chrome_driver_path)
+            with WEBDRIVER_STARTUP_SECONDS.time():
+                self.driver = webdriver.Chrome(chrome_options=self.options, executable_path=self.chrome_driver_path)
+
+    def is_healthy(self):
+        if self.driver is None:
+            return False
+        try:
+            self.driver.current_url
+            return True
+        except WebDriverException:
+            return False
 
     def close_webdriver(self):
         if self.driver is not None:
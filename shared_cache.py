@@ -0,0 +1,142 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class SharedCache:
+    # Used when no SHARED_CACHE_URL is configured, every worker just does its own work
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def acquire_lock(self, key, ttl):
+        return True
+
+    def release_lock(self, key):
+        pass
+
+    def locked(self, key):
+        return False
+
+    def wait_for(self, key, timeout, interval=0.2):
+        # Returns the value once it is set, or None if the lock holder gave up without setting it or time ran out
+        deadline = time.monotonic() + timeout
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return value
+            if not self.locked(key):
+                # The holder may have set the value just before releasing
+                return self.get(key)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(interval)
+
+
+class SQLiteSharedCache(SharedCache):
+    # A file every worker process on the box can open, for when there is no Redis to talk to
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.connection().execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self.connection().execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            return None
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        self.connection().execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                                  (key, json.dumps(value), expires))
+
+    def delete(self, key):
+        self.connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def acquire_lock(self, key, ttl):
+        lock_key = f"lock:{key}"
+        now = time.time()
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM cache WHERE key = ? AND expires < ?", (lock_key, now))
+            inserted = connection.execute("INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                                          (lock_key, json.dumps(os.getpid()), now + ttl)).rowcount
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.execute("ROLLBACK")
+            raise
+        return inserted == 1
+
+    def release_lock(self, key):
+        self.delete(f"lock:{key}")
+
+    def locked(self, key):
+        row = self.connection().execute("SELECT 1 FROM cache WHERE key = ? AND expires >= ?",
+                                        (f"lock:{key}", time.time())).fetchone()
+        return row is not None
+
+
+class RedisSharedCache(SharedCache):
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SHARED_CACHE_URL points at Redis but the redis package is not installed")
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def acquire_lock(self, key, ttl):
+        return bool(self.client.set(f"lock:{key}", os.getpid(), nx=True, ex=int(ttl)))
+
+    def release_lock(self, key):
+        self.client.delete(f"lock:{key}")
+
+    def locked(self, key):
+        return bool(self.client.exists(f"lock:{key}"))
+
+
+def create_shared_cache(url=None):
+    url = url if url is not None else os.getenv("SHARED_CACHE_URL", "")
+    if not url:
+        return SharedCache()
+    elif url.startswith("redis://") or url.startswith("rediss://"):
+        return RedisSharedCache(url)
+    elif url.startswith("sqlite:///"):
+        return SQLiteSharedCache(url[len("sqlite:///"):])
+    else:
+        raise ValueError(f"Unsupported SHARED_CACHE_URL: {url}")
@@ -0,0 +1,57 @@
+import threading
+
+
+class FlightTimeout(Exception):
+    pass
+
+
+class Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Concurrent calls for the same key share one execution: the first caller runs the function, everyone who
+    # arrives while it is running waits for it, up to timeout seconds, and gets the same result or exception.
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, function):
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = Flight()
+                self.flights[key] = flight
+                leader = True
+
+        if not leader:
+            if not flight.done.wait(self.timeout):
+                raise FlightTimeout(f"Gave up waiting for {key} after {self.timeout} seconds")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": len(self.flights), "coalesced": self.coalesced}
@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin, urlparse
+from story_manager import HTML_PARSER, StoryManager
+from translation_cache import TranslationCache
+import os
+import re
+import requests
+
+
+class StoryCrawler:
+
+    def __init__(self, story_manager=None, concurrency=None, max_pages=None):
+        self.concurrency = concurrency or int(os.getenv("CRAWLER_CONCURRENCY", 4))
+        self.max_pages = max_pages or int(os.getenv("CRAWLER_MAX_PAGES", 20))
+        # One keep-alive connection per worker thread instead of a new connection for every page
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.story_manager = story_manager or StoryManager(session=self.session)
+        self.base_path = urlparse(self.story_manager.base_url).path
+        # Index page url -> (etag, last_modified, text), so index pages that haven't changed come back as a 304.
+        # Story pages aren't kept: once a slug has a job it is never fetched again.
+        self.validators = TranslationCache(max_size=int(os.getenv("CRAWLER_VALIDATOR_CACHE_SIZE", 2 * self.max_pages)),
+                                           ttl=0)
+
+    def get(self, url, remember=True):
+        # Returns (text, etag)
+        etag, last_modified, cached_text = (self.validators.get(url) if remember else None) or (None, None, None)
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        response = self.session.get(url, headers=headers, timeout=30)
+        if response.status_code == 304 and cached_text is not None:
+            return cached_text, etag
+        response.raise_for_status()
+        if remember and (response.headers.get("ETag") or response.headers.get("Last-Modified")):
+            self.validators.set(url, (response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                                      response.text))
+        return response.text, response.headers.get("ETag")
+
+    def discover_slugs(self):
+        slugs = []
+        seen_pages = set()
+        pages = [self.story_manager.base_url]
+        page_pattern = re.compile(re.escape(self.base_path) + r"page/\d+/?$")
+        slug_pattern = re.compile(re.escape(self.base_path) + r"([\w-]+)/?$")
+        while pages and len(seen_pages) < self.max_pages:
+            page_url = pages.pop(0)
+            if page_url in seen_pages:
+                continue
+            seen_pages.add(page_url)
+            try:
+                html = self.get(page_url)[0]
+            except requests.RequestException as e:
+                print(f"Error fetching index page {page_url}: {e}")
+                continue
+            for link in BeautifulSoup(html, HTML_PARSER, parse_only=SoupStrainer("a", href=True)).find_all("a"):
+                url = urljoin(page_url, link["href"]).split("#")[0]
+                path = urlparse(url).path
+                if page_pattern.match(path):
+                    if url not in seen_pages and url not in pages:
+                        pages.append(url)
+                    continue
+                match = slug_pattern.match(path)
+                if match and match.group(1) != "page" and match.group(1) not in slugs:
+                    slugs.append(match.group(1))
+        return slugs
+
+    def fetch_story(self, slug):
+        try:
+            url = self.story_manager.story_url(slug)
+            html, etag = self.get(url, remember=False)
+            return slug, self.story_manager.parse_story(html, url=url, etag=etag)
+        except (requests.RequestException, AttributeError) as e:
+            # AttributeError is a page without the story's <h1>
+            print(f"Error fetching story {slug}: {e}")
+            return slug, None
+
+    def fetch_stories(self, slugs):
+        # Yields (slug, (title, paragraphs)) in the order of slugs, with None for stories that couldn't be read
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            yield from executor.map(self.fetch_story, slugs)
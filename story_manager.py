@@ -1,22 +1,65 @@
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from metrics import registry
+from translation_cache import TranslationCache
+import hashlib
+import os
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+FETCH_STORY_SECONDS = registry.histogram("hola_fetch_story_seconds", "Time taken to download and parse a story",
+                                         ("stage",))
+# Only the title and the paragraphs are built into the tree, the navigation, sidebars and scripts are skipped
+STORY_STRAINER = SoupStrainer(["h1", "p"])
+# (url, etag or content hash) -> (title, paragraphs), shared by every StoryManager in the process
+parse_cache = TranslationCache(max_size=int(os.getenv("STORY_PARSE_CACHE_SIZE", 256)),
+                               ttl=float(os.getenv("STORY_PARSE_CACHE_TTL", 3600)))
+
+
+def is_story_paragraph(style):
+    # Story paragraphs are the justified ones, whatever else is in the style ("text-align:justify", padding, ...)
+    return style is not None and "text-align:justify" in "".join(style.split()).lower()
 
 
 class StoryManager:
 
-    def __init__(self):
+    def __init__(self, session=None):
         self.titles = ["perro-aterrado"]
-        self.base_url = "https://www.mundoprimaria.com/cuentos-infantiles-cortos/cuentos-populares/"
+        self.base_url = os.getenv("STORY_BASE_URL",
+                                  "https://www.mundoprimaria.com/cuentos-infantiles-cortos/cuentos-populares/")
+        self.session = session or requests
+
+    def story_url(self, story):
+        return self.base_url + story
 
     def fetch_story(self, story):
         if story is None:
             story = self.titles[0]
-        web_site_html = requests.get(self.base_url + story)
-        soup = BeautifulSoup(web_site_html.text, "html.parser")
+        url = self.story_url(story)
+        with FETCH_STORY_SECONDS.time("download"):
+            web_site_html = self.session.get(url)
+        return self.parse_story(web_site_html.text, url=url, etag=web_site_html.headers.get("ETag"))
+
+    def parse_story(self, html, url=None, etag=None):
+        cache_key = (url, etag or hashlib.sha1(html.encode("utf-8")).hexdigest())
+        cached = parse_cache.get(cache_key)
+        if cached is not None:
+            title, text = cached
+            return title, list(text)
+
+        with FETCH_STORY_SECONDS.time("parse"):
+            soup = BeautifulSoup(html, HTML_PARSER, parse_only=STORY_STRAINER)
 
-        title = soup.find(name="h1", class_="text-center").getText()
-        text = [paragraph.getText() for paragraph in soup.find_all(name="p",
-                                                                   style=["text-align: justify;",
-                                                                          "text-align: justify; padding-left: 40px;"])]
+            title = (soup.find(name="h1", class_="text-center") or soup.find(name="h1")).getText().strip()
+            text = []
+            for paragraph in soup.find_all(name="p", style=is_story_paragraph):
+                paragraph_text = paragraph.getText().strip()
+                if paragraph_text:
+                    text.append(paragraph_text)
 
+        parse_cache.set(cache_key, (title, tuple(text)))
         return title, text
@@ -0,0 +1,37 @@
+from api_key_index import ApiKeyIndex
+
+
+def test_deletion_announced_by_another_worker_is_picked_up():
+    keys = [("abc", 1), ("def", 2)]
+    announced = {}
+    index = ApiKeyIndex(lambda: list(keys), refresh_interval=3600, changed_at=lambda: announced.get("at"),
+                        check_interval=0.001)
+    index.refresh()
+    assert index.lookup("abc") == 1
+
+    # Another worker deletes the account and stamps the change
+    keys.remove(("abc", 1))
+    announced["at"] = index.loaded_at_wall + 1
+    index.checked_at = None
+    assert index.lookup("abc") is None
+    assert index.lookup("def") == 2
+
+
+def test_without_an_announcement_the_index_is_not_reloaded():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return [("abc", 1)]
+
+    index = ApiKeyIndex(loader, refresh_interval=3600, changed_at=lambda: None, check_interval=0.001)
+    index.refresh()
+    for _ in range(10):
+        assert index.lookup("abc") == 1
+    assert len(calls) == 1
+
+
+def test_wrong_key_is_rejected():
+    index = ApiKeyIndex(lambda: [("abc", 1)], refresh_interval=3600)
+    assert index.lookup("abd") is None
+    assert index.lookup("") is None
@@ -0,0 +1,60 @@
+import json
+import multiprocessing
+
+from file_manager import FileManager
+
+WORKERS = 4
+PHRASES = 150
+
+
+def append_phrases(directory, worker):
+    files = FileManager(str(directory))
+    # Every phrase is written twice so the logs keep crossing the compaction threshold while others append
+    files.compact_ratio = 1.2
+    for i in range(PHRASES):
+        files.save_new_translation((f"{worker}-{i}", "draft"), "cuento")
+        files.save_new_translation((f"{worker}-{i}", f"final {worker}-{i}"), "cuento")
+
+
+def test_concurrent_appends_survive_compaction(tmp_path):
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=append_phrases, args=(tmp_path, worker)) for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    files = FileManager(str(tmp_path))
+    for worker in range(WORKERS):
+        for i in range(PHRASES):
+            assert files.check_for_existing_translation(f"{worker}-{i}", "cuento") == f"final {worker}-{i}"
+    assert len(files.translation_log("cuento").entries) == WORKERS * PHRASES
+
+
+def test_legacy_story_file_is_imported(tmp_path):
+    content = [{"es": "Había una vez.", "en": "Once upon a time."}, {"es": "Fin.", "en": "The end."}]
+    (tmp_path / "cuento.txt").write_text(json.dumps({"content": content}))
+
+    files = FileManager(str(tmp_path))
+    assert files.check_for_existing_translation("Fin.", "cuento") == "The end."
+    assert (tmp_path / "cuento.jsonl").exists()
+    assert files.return_story("cuento") == ("********* SPANISH *********\nHabía una vez.\nFin.\n"
+                                            "********* ENGLISH *********\nOnce upon a time.\nThe end.\n")
+
+
+def test_missing_story_returns_none(tmp_path):
+    assert FileManager(str(tmp_path)).return_story("nada") is None
+
+
+def test_least_recently_used_logs_are_evicted(tmp_path):
+    files = FileManager(str(tmp_path), max_open_logs=2)
+    files.save_new_translation(("uno", "one"), "a")
+    files.save_new_translation(("dos", "two"), "b")
+    files.check_for_existing_translation("uno", "a")
+    files.save_new_translation(("tres", "three"), "c")
+
+    assert list(files.logs) == ["a", "c"]
+    # An evicted log is read back from disk
+    assert files.check_for_existing_translation("dos", "b") == "two"
+    assert list(files.logs) == ["c", "b"]
@@ -0,0 +1,52 @@
+from metrics import Registry
+import multiprocessing
+
+
+def worker_process(directory, requests):
+    registry = Registry(directory)
+    counter = registry.counter("hola_requests_total", "Requests", ("status",))
+    histogram = registry.histogram("hola_request_seconds", "Latency", buckets=(0.1, 1))
+    registry.gauge("hola_sessions_open", "Sessions", lambda: 3)
+    for _ in range(requests):
+        counter.inc(1, "200")
+        histogram.observe(0.5)
+    registry.write_snapshot()
+
+
+def run_worker(directory, requests):
+    process = multiprocessing.Process(target=worker_process, args=(directory, requests))
+    process.start()
+    process.join()
+
+
+def test_without_a_directory_only_this_process_is_rendered():
+    registry = Registry(directory="")
+    registry.counter("hola_requests_total", "Requests").inc(2)
+    assert "hola_requests_total 2" in registry.render()
+
+
+def test_scrapes_add_up_every_workers_counters_and_histograms(tmp_path):
+    run_worker(str(tmp_path), 3)
+    run_worker(str(tmp_path), 4)
+
+    registry = Registry(str(tmp_path))
+    counter = registry.counter("hola_requests_total", "Requests", ("status",))
+    registry.histogram("hola_request_seconds", "Latency", buckets=(0.1, 1))
+    registry.gauge("hola_sessions_open", "Sessions", lambda: 1)
+    counter.inc(1, "200")
+    output = registry.render()
+
+    assert 'hola_requests_total{status="200"} 8' in output
+    assert "hola_request_seconds_count 7" in output
+    assert 'hola_request_seconds_bucket{le="1"} 7' in output
+    # The workers have exited, so only this process's gauge is live
+    assert "hola_sessions_open 1" in output
+
+
+def test_gauges_can_be_combined_with_max_or_mean(tmp_path):
+    registry = Registry(str(tmp_path))
+    registry.gauge("hola_wait_max", "Wait", lambda: 2.0, aggregate="max")
+    registry.gauge("hola_hit_ratio", "Ratio", lambda: 0.5, aggregate="mean")
+    output = registry.render()
+    assert "hola_wait_max 2.0" in output
+    assert "hola_hit_ratio 0.5" in output
@@ -0,0 +1,49 @@
+import rate_limiter
+from rate_limiter import RateLimiter
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def limiter(monkeypatch, rate, burst):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    return RateLimiter(rate=rate, burst=burst), clock
+
+
+def test_allows_a_burst_then_limits(monkeypatch):
+    limits, clock = limiter(monkeypatch, rate=1, burst=3)
+    assert [limits.allow("a") for _ in range(4)] == [True, True, True, False]
+
+
+def test_keys_have_separate_buckets(monkeypatch):
+    limits, clock = limiter(monkeypatch, rate=1, burst=1)
+    assert limits.allow("a")
+    assert not limits.allow("a")
+    assert limits.allow("b")
+
+
+def test_tokens_refill_at_rate_up_to_burst(monkeypatch):
+    limits, clock = limiter(monkeypatch, rate=2, burst=3)
+    for _ in range(3):
+        limits.allow("a")
+    clock.now += 0.5
+    assert limits.allow("a")
+    assert not limits.allow("a")
+    # A long idle spell refills the bucket to burst, not beyond
+    clock.now += 60
+    assert [limits.allow("a") for _ in range(4)] == [True, True, True, False]
+
+
+def test_retry_after_is_the_time_until_the_next_token(monkeypatch):
+    limits, clock = limiter(monkeypatch, rate=4, burst=1)
+    assert limits.retry_after("a") == 0.0
+    limits.allow("a")
+    assert not limits.allow("a")
+    assert limits.retry_after("a") == 0.25
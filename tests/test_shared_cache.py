@@ -0,0 +1,42 @@
+import threading
+import time
+
+from shared_cache import SQLiteSharedCache
+
+
+def cache(tmp_path):
+    return SQLiteSharedCache(str(tmp_path / "cache.db"))
+
+
+def release_later(shared, key, value=None):
+    def release():
+        time.sleep(0.1)
+        if value is not None:
+            shared.set(key, value)
+        shared.release_lock(key)
+    threading.Thread(target=release).start()
+
+
+def test_waiter_gets_the_value_the_holder_sets(tmp_path):
+    shared = cache(tmp_path)
+    assert shared.acquire_lock("word", ttl=60)
+    release_later(shared, "word", {"en": "word"})
+    assert shared.wait_for("word", timeout=5, interval=0.01) == {"en": "word"}
+
+
+def test_waiter_stops_as_soon_as_the_holder_gives_up(tmp_path):
+    shared = cache(tmp_path)
+    assert shared.acquire_lock("word", ttl=60)
+    release_later(shared, "word")
+    started = time.monotonic()
+    assert shared.wait_for("word", timeout=5, interval=0.01) is None
+    assert time.monotonic() - started < 1
+    assert shared.acquire_lock("word", ttl=60)
+
+
+def test_waiter_times_out_while_the_lock_is_held(tmp_path):
+    shared = cache(tmp_path)
+    assert shared.acquire_lock("word", ttl=60)
+    assert shared.locked("word")
+    assert shared.wait_for("word", timeout=0.1, interval=0.01) is None
+    assert not shared.acquire_lock("word", ttl=60)
@@ -0,0 +1,86 @@
+from single_flight import FlightTimeout, SingleFlight
+import threading
+import time
+import pytest
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+    barrier = threading.Barrier(count)
+
+    def call(i):
+        barrier.wait()
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_misses_share_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    def translate():
+        calls.append(1)
+        time.sleep(0.3)
+        return "dog"
+
+    results = run_concurrently(10, lambda: flights.do("perro", translate))
+
+    assert results == ["dog"] * 10
+    assert len(calls) == 1
+    assert flights.stats() == {"in_flight": 0, "coalesced": 9}
+
+
+def test_followers_get_the_leaders_exception():
+    flights = SingleFlight()
+
+    def translate():
+        time.sleep(0.2)
+        raise ValueError("translator down")
+
+    results = run_concurrently(5, lambda: flights.do("perro", translate))
+
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_different_keys_do_not_wait_on_each_other():
+    flights = SingleFlight()
+    calls = []
+
+    def translate(word):
+        calls.append(word)
+        return word.upper()
+
+    assert flights.do("perro", lambda: translate("perro")) == "PERRO"
+    assert flights.do("gato", lambda: translate("gato")) == "GATO"
+    assert calls == ["perro", "gato"]
+
+
+def test_a_finished_flight_is_not_reused():
+    flights = SingleFlight()
+    assert flights.do("perro", lambda: "dog") == "dog"
+    assert flights.do("perro", lambda: "hound") == "hound"
+
+
+def test_followers_stop_waiting_after_the_timeout():
+    flights = SingleFlight(timeout=0.1)
+    release = threading.Event()
+    leader = threading.Thread(target=lambda: flights.do("perro", release.wait))
+    leader.start()
+    while not flights.stats()["in_flight"]:
+        time.sleep(0.01)
+
+    with pytest.raises(FlightTimeout):
+        flights.do("perro", lambda: "never called")
+
+    release.set()
+    leader.join()
+    assert flights.stats()["in_flight"] == 0
@@ -0,0 +1,33 @@
+from text_normalization import clean, fold_accents, normalize
+
+
+def test_clean_folds_case_and_trims_punctuation_and_whitespace():
+    assert clean("Perro") == "perro"
+    assert clean("  perro  ") == "perro"
+    assert clean("perro.") == "perro"
+    assert clean("¿Qué?") == "qué"
+    assert clean("  ¡Buenos   días!  ") == "buenos días"
+
+
+def test_clean_keeps_punctuation_inside_the_text():
+    assert clean("«arco-iris»") == "arco-iris"
+
+
+def test_clean_composes_decomposed_accents():
+    assert clean("café") == "café"
+
+
+def test_clean_passes_none_through():
+    assert clean(None) is None
+    assert normalize(None) is None
+
+
+def test_folding_accents_keeps_the_tilde_of_ene():
+    assert fold_accents("canción") == "cancion"
+    assert fold_accents("año") == "año"
+    assert fold_accents("cañón") == "cañon"
+
+
+def test_normalize_only_folds_when_asked():
+    assert normalize("¿Canción?", fold=False) == "canción"
+    assert normalize("¿Canción?", fold=True) == "cancion"
@@ -0,0 +1,57 @@
+from contextlib import contextmanager
+
+from translation_backends import SeleniumTranslationBackend
+
+
+class FakeTranslator:
+
+    def __init__(self, merge_lines=False):
+        self.merge_lines = merge_lines
+        self.submissions = []
+
+    def translate(self, text, title):
+        self.submissions.append(text)
+        translated = "\n".join(f"en:{line}" for line in text.split("\n"))
+        if self.merge_lines and "\n" in text:
+            return translated.replace("\n", " ", 1)
+        return translated
+
+
+class FakePool:
+
+    def __init__(self, translator):
+        self.translator = translator
+
+    @contextmanager
+    def session(self):
+        yield self.translator
+
+
+def backend(max_chunk_chars, merge_lines=False):
+    translator = FakeTranslator(merge_lines)
+    return SeleniumTranslationBackend(pool=FakePool(translator), max_chunk_chars=max_chunk_chars), translator
+
+
+def test_chunks_pack_texts_up_to_the_limit():
+    translation, translator = backend(max_chunk_chars=12)
+    # "uno\n" + "dos\n" is 8 characters, "tres\n" would take it to 13
+    assert translation.chunk(["uno", "dos", "tres", "cuatro"]) == [[0, 1], [2, 3]]
+
+
+def test_long_and_multiline_texts_go_alone():
+    translation, translator = backend(max_chunk_chars=10)
+    assert translation.chunk(["uno", "muy muy largo", "a\nb", "dos"]) == [[1], [2], [0, 3]]
+
+
+def test_batch_is_split_back_in_order():
+    translation, translator = backend(max_chunk_chars=12)
+    texts = ["uno", "dos", "tres", "cuatro", "muy muy largo"]
+    assert translation.translate_batch(texts, "cuento") == [f"en:{text}" for text in texts]
+    assert translator.submissions == ["uno\ndos", "muy muy largo", "tres\ncuatro"]
+
+
+def test_mismatched_line_count_falls_back_to_one_by_one():
+    translation, translator = backend(max_chunk_chars=100, merge_lines=True)
+    texts = ["uno", "dos", "tres"]
+    assert translation.translate_batch(texts, "cuento") == ["en:uno", "en:dos", "en:tres"]
+    assert translator.submissions == ["uno\ndos\ntres", "uno", "dos", "tres"]
@@ -0,0 +1,23 @@
+from translation_memory import split_sentences
+
+
+def test_splits_at_sentence_ends():
+    assert split_sentences("Hola. ¿Qué tal?  ¡Muy bien!") == ["Hola.", "¿Qué tal?", "¡Muy bien!"]
+
+
+def test_closing_quotes_stay_with_their_sentence():
+    assert split_sentences("«Ven aquí.» Y se fue.") == ["«Ven aquí.»", "Y se fue."]
+
+
+def test_dialogue_continuation_stays_with_its_sentence():
+    paragraph = "¿Por qué tienes miedo? – le preguntó el gato. – ¡Porque sí! – dijo."
+    assert split_sentences(paragraph) == ["¿Por qué tienes miedo? – le preguntó el gato.", "– ¡Porque sí! – dijo."]
+
+
+def test_lowercase_continuation_stays_with_its_sentence():
+    assert split_sentences("¿Vienes? dijo ella. No.") == ["¿Vienes? dijo ella.", "No."]
+
+
+def test_abbreviations_do_not_end_a_sentence():
+    assert split_sentences("Vino el Sr. Pérez con la Dra. Ruiz. Se fueron.") == [
+        "Vino el Sr. Pérez con la Dra. Ruiz.", "Se fueron."]
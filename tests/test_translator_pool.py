@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+import translator_pool
+from translator_pool import TranslatorPool, TranslatorPoolExhausted
+
+
+class FakeTranslator:
+
+    def __init__(self):
+        self.uses = 0
+        self.closed = False
+
+    def initialise_webdriver(self):
+        pass
+
+    def is_healthy(self):
+        return True
+
+    def close_webdriver(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def fake_translator(monkeypatch):
+    monkeypatch.setattr(translator_pool, "SeleniumTranslationManger", FakeTranslator)
+
+
+def test_waiter_takes_the_session_that_is_checked_in():
+    pool = TranslatorPool(max_sessions=1, max_uses=10, checkout_timeout=2)
+    holder = pool.checkout()
+    threading.Timer(0.1, pool.checkin, args=(holder,)).start()
+    started = time.monotonic()
+    assert pool.checkout() is holder
+    assert time.monotonic() - started < 1
+
+
+def test_waiter_opens_a_session_when_one_is_discarded():
+    pool = TranslatorPool(max_sessions=1, max_uses=1, checkout_timeout=2)
+    holder = pool.checkout()
+    # Its one use is up, so checking it in recycles it and frees the slot
+    threading.Timer(0.1, pool.checkin, args=(holder,)).start()
+    started = time.monotonic()
+    translator = pool.checkout()
+    assert translator is not holder and holder.closed
+    assert time.monotonic() - started < 1
+    assert pool.stats() == {"open": 1, "idle": 0, "max": 1}
+
+
+def test_checkout_gives_up_after_the_timeout():
+    pool = TranslatorPool(max_sessions=1, max_uses=10, checkout_timeout=0.1)
+    pool.checkout()
+    with pytest.raises(TranslatorPoolExhausted):
+        pool.checkout()
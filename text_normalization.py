@@ -0,0 +1,38 @@
+import os
+import unicodedata
+
+FOLD_ACCENTS = os.getenv("NORMALIZE_FOLD_ACCENTS", "0") == "1"
+# U+0303 is the tilde of ñ, folding it would turn "año" into "ano"
+KEEP_MARKS = {"\u0303"}
+
+
+def is_punctuation(character):
+    return unicodedata.category(character).startswith("P")
+
+
+def clean(text):
+    # NFC, case folded, whitespace collapsed and punctuation trimmed from both ends: "  ¿Perro? " -> "perro"
+    if text is None:
+        return None
+    text = " ".join(unicodedata.normalize("NFC", text).casefold().split())
+    start = 0
+    end = len(text)
+    while start < end and (is_punctuation(text[start]) or text[start].isspace()):
+        start += 1
+    while end > start and (is_punctuation(text[end - 1]) or text[end - 1].isspace()):
+        end -= 1
+    return text[start:end]
+
+
+def fold_accents(text):
+    decomposed = unicodedata.normalize("NFD", text)
+    return unicodedata.normalize("NFC", "".join(character for character in decomposed
+                                                if not unicodedata.combining(character) or character in KEEP_MARKS))
+
+
+def normalize(text, fold=None):
+    # The canonical key words are stored and looked up by, accents are only folded when NORMALIZE_FOLD_ACCENTS=1
+    text = clean(text)
+    if text and (FOLD_ACCENTS if fold is None else fold):
+        text = fold_accents(text)
+    return text
@@ -0,0 +1,201 @@
+from translator_pool import TranslatorPool
+from file_manager import FileManager
+import json
+import os
+import requests
+
+
+class TranslationBackend:
+
+    def translate(self, text, title):
+        raise NotImplementedError
+
+    def translate_batch(self, texts, title):
+        return [self.translate(text, title) for text in texts]
+
+    def pool_stats(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class SeleniumTranslationBackend(TranslationBackend):
+
+    def __init__(self, pool=None, max_chunk_chars=None):
+        self.pool = pool or TranslatorPool()
+        self.max_chunk_chars = max_chunk_chars or int(os.getenv("TRANSLATE_BATCH_MAX_CHARS", 4500))
+
+    def translate(self, text, title):
+        with self.pool.session() as translator:
+            return translator.translate(text=text, title=title)
+
+    def translate_batch(self, texts, title):
+        results = [None] * len(texts)
+        with self.pool.session() as translator:
+            for chunk in self.chunk(texts):
+                if len(chunk) == 1:
+                    i = chunk[0]
+                    results[i] = translator.translate(text=texts[i], title=title)
+                    continue
+                translated = translator.translate(text="\n".join(texts[i] for i in chunk), title=title)
+                lines = translated.split("\n") if translated else []
+                if len(lines) == len(chunk):
+                    for i, en in zip(chunk, lines):
+                        results[i] = en.strip()
+                else:
+                    # The translator merged or split lines, so the chunk can't be mapped back reliably
+                    print(f"Batch of {len(chunk)} came back as {len(lines)} lines, translating one by one")
+                    for i in chunk:
+                        results[i] = translator.translate(text=texts[i], title=title)
+        return results
+
+    def chunk(self, texts):
+        # Groups indexes of texts into newline-joined submissions no longer than max_chunk_chars
+        chunks = []
+        current = []
+        current_size = 0
+        for i, text in enumerate(texts):
+            if "\n" in text or len(text) >= self.max_chunk_chars:
+                chunks.append([i])
+                continue
+            if current and current_size + len(text) + 1 > self.max_chunk_chars:
+                chunks.append(current)
+                current = []
+                current_size = 0
+            current.append(i)
+            current_size += len(text) + 1
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def pool_stats(self):
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.close()
+
+
+class LocalDictionaryTranslationBackend(TranslationBackend):
+
+    def __init__(self, dictionary_path=None, fallback=None):
+        self.dictionary_path = dictionary_path or os.getenv("TRANSLATION_DICTIONARY")
+        self.fallback = fallback
+        self.phrases = {}
+        if self.dictionary_path:
+            self.load(self.dictionary_path)
+
+    def load(self, dictionary_path):
+        # A flat JSON object of {"es": "en"} pairs
+        with open(dictionary_path, encoding="utf-8") as file:
+            data = json.load(file)
+        for es, en in data.items():
+            self.phrases[self.phrase_key(es)] = en
+
+    def phrase_key(self, text):
+        return text.strip().lower()
+
+    def translate(self, text, title):
+        en = self.phrases.get(self.phrase_key(text))
+        if en is None and self.fallback:
+            return self.fallback.translate(text, title)
+        return en
+
+    def translate_batch(self, texts, title):
+        results = [self.phrases.get(self.phrase_key(text)) for text in texts]
+        if self.fallback:
+            misses = [i for i, en in enumerate(results) if en is None]
+            if misses:
+                translated = self.fallback.translate_batch([texts[i] for i in misses], title)
+                for i, en in zip(misses, translated):
+                    results[i] = en
+        return results
+
+    def pool_stats(self):
+        if self.fallback:
+            return self.fallback.pool_stats()
+        return None
+
+    def close(self):
+        if self.fallback:
+            self.fallback.close()
+
+
+class HttpTranslationBackend(TranslationBackend):
+    # Talks to any service that accepts {"source", "target", "q": [...]} and answers {"translations": [...]},
+    # which is what the mock translation server used for local benchmarking speaks
+
+    def __init__(self, url=None, timeout=None):
+        self.url = url or os.getenv("TRANSLATION_HTTP_URL", "http://127.0.0.1:8765/translate")
+        self.timeout = timeout or float(os.getenv("TRANSLATION_HTTP_TIMEOUT", 10))
+        self.session = requests.Session()
+
+    def translate(self, text, title):
+        return self.translate_batch([text], title)[0]
+
+    def translate_batch(self, texts, title):
+        try:
+            response = self.session.post(self.url, json={"source": "es", "target": "en", "q": list(texts)},
+                                         timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()["translations"]
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Error calling translation service: {e}")
+            return [None for _ in texts]
+
+    def close(self):
+        self.session.close()
+
+
+class FileCachedTranslationBackend(TranslationBackend):
+    # Checks FileManager's per-title translation logs before asking the backend, and logs what it translates,
+    # for deployments that want a translation cache without the database
+
+    def __init__(self, backend, file_manager=None):
+        self.backend = backend
+        self.file_manager = file_manager or FileManager()
+
+    def translate(self, text, title):
+        en = self.file_manager.check_for_existing_translation(text, title)
+        if en is None:
+            en = self.backend.translate(text, title)
+            if en is not None:
+                self.file_manager.save_new_translation((text, en), title)
+        return en
+
+    def translate_batch(self, texts, title):
+        results = [self.file_manager.check_for_existing_translation(text, title) for text in texts]
+        misses = [i for i, en in enumerate(results) if en is None]
+        if misses:
+            translated = self.backend.translate_batch([texts[i] for i in misses], title)
+            for i, en in zip(misses, translated):
+                results[i] = en
+                if en is not None:
+                    self.file_manager.save_new_translation((texts[i], en), title)
+        return results
+
+    def pool_stats(self):
+        return self.backend.pool_stats()
+
+    def close(self):
+        self.backend.close()
+
+
+def create_translation_backend(name=None):
+    backend = select_translation_backend(name or os.getenv("TRANSLATION_BACKEND", "selenium"))
+    if os.getenv("TRANSLATION_FILE_CACHE") == "1":
+        return FileCachedTranslationBackend(backend)
+    return backend
+
+
+def select_translation_backend(name):
+    if name == "selenium":
+        return SeleniumTranslationBackend()
+    elif name == "http":
+        return HttpTranslationBackend()
+    elif name == "local":
+        fallback_name = os.getenv("TRANSLATION_FALLBACK")
+        fallback = select_translation_backend(fallback_name) if fallback_name else None
+        return LocalDictionaryTranslationBackend(fallback=fallback)
+    else:
+        raise ValueError(f"Unknown translation backend: {name}")
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+
+
+class TranslationCache:
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size or int(os.getenv("TRANSLATION_CACHE_SIZE", 10000))
+        # Other gunicorn workers can't invalidate this process's copy, so the TTL bounds how stale an admin edit can be
+        self.ttl = ttl if ttl is not None else float(os.getenv("TRANSLATION_CACHE_TTL", 3600))
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, es):
+        with self.lock:
+            entry = self.entries.get(es)
+            if entry is not None:
+                en, expires = entry
+                if not self.ttl or expires > time.monotonic():
+                    self.entries.move_to_end(es)
+                    self.hits += 1
+                    return en
+                del self.entries[es]
+            self.misses += 1
+            return None
+
+    def set(self, es, en):
+        if es is None or en is None:
+            return
+        with self.lock:
+            self.entries[es] = (en, time.monotonic() + self.ttl)
+            self.entries.move_to_end(es)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, es):
+        with self.lock:
+            self.entries.pop(es, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0
+            }
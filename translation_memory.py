@@ -0,0 +1,101 @@
+from sqlalchemy import select
+import hashlib
+import re
+
+# A sentence ends at . ! ? or … followed by whitespace, closing quotes and brackets stay with their sentence
+SENTENCE_END = re.compile(r"([.!?…]+[»”\"')\]]*)\s+")
+# "¿Qué quieres? – le preguntó." and "¿Qué? dijo" are one sentence: a dash-led or lowercase continuation
+CONTINUATION = re.compile(r"[-–—]?\s*[a-záéíóúüñ]")
+# A period after these is part of the word, not the end of the sentence: "el Sr. Pérez"
+ABBREVIATIONS = {"sr", "sra", "srta", "sres", "dr", "dra", "d", "dña", "ud", "uds", "vd", "vds", "lic", "ing",
+                 "prof", "pág", "núm", "aprox", "av", "avda", "ej", "tel", "vol", "cap"}
+LAST_WORD = re.compile(r"(\w+)$")
+
+
+class TranslationMemory:
+    # Remembers the translation of every sentence of every ingested story, so phrasing that repeats across
+    # stories is only ever sent to the translator once. Sentences are looked up by a hash of their text.
+
+    def __init__(self, db, bulk_loader, lookup_batch_size=500):
+        self.db = db
+        self.bulk_loader = bulk_loader
+        self.lookup_batch_size = lookup_batch_size
+        self.sentences = db.metadata.tables["sentences"]
+        self.paragraphs = db.metadata.tables["paragraphs"]
+
+    def split(self, paragraph):
+        return split_sentences(paragraph)
+
+    def key(self, sentence):
+        return hashlib.sha1(" ".join(sentence.split()).encode("utf-8")).hexdigest()
+
+    def in_batches(self, values):
+        values = list(values)
+        for i in range(0, len(values), self.lookup_batch_size):
+            yield values[i:i + self.lookup_batch_size]
+
+    def lookup(self, sentences):
+        # sentence -> en for every sentence that is remembered
+        keys = {self.key(sentence): sentence for sentence in sentences}
+        found = {}
+        for batch in self.in_batches(keys):
+            for row in self.db.session.execute(
+                    select([self.sentences.c.key, self.sentences.c.en]).where(self.sentences.c.key.in_(batch))):
+                found[keys[row.key]] = row.en
+        return found
+
+    def lookup_paragraphs(self, paragraphs):
+        # paragraph -> en for every paragraph a saved story already has word for word
+        found = {}
+        for batch in self.in_batches(set(paragraphs)):
+            for row in self.db.session.execute(
+                    select([self.paragraphs.c.es, self.paragraphs.c.en]).where(self.paragraphs.c.es.in_(batch))):
+                found.setdefault(row.es, row.en)
+        return found
+
+    def seed_from_paragraphs(self, batch_size=1000):
+        # Remembers the sentences of stories saved before the memory existed. A paragraph is only used when its
+        # Spanish and English split into the same number of sentences, otherwise they can't be paired up.
+        remembered = 0
+        last_id = 0
+        while True:
+            rows = self.db.session.execute(
+                select([self.paragraphs.c.id, self.paragraphs.c.es, self.paragraphs.c.en])
+                .where(self.paragraphs.c.id > last_id).order_by(self.paragraphs.c.id).limit(batch_size)).fetchall()
+            if not rows:
+                return remembered
+            last_id = rows[-1].id
+            translations = []
+            for row in rows:
+                es_sentences = split_sentences(row.es)
+                en_sentences = split_sentences(row.en)
+                if len(es_sentences) == len(en_sentences):
+                    translations.extend(zip(es_sentences, en_sentences))
+            remembered += self.remember(translations)
+            self.db.session.commit()
+
+    def remember(self, translations):
+        rows = [{"key": self.key(es), "es": es, "en": en} for es, en in translations if en is not None]
+        if not rows:
+            return 0
+        return self.bulk_loader.insert_ignoring_conflicts(self.db.session.connection(), self.sentences, rows)
+
+
+def ends_with_abbreviation(text):
+    word = LAST_WORD.search(text)
+    return word is not None and word.group(1).casefold() in ABBREVIATIONS
+
+
+def split_sentences(paragraph):
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(paragraph):
+        if CONTINUATION.match(paragraph, match.end()):
+            continue
+        if match.group(1) == "." and ends_with_abbreviation(paragraph[start:match.start()]):
+            continue
+        sentences.append(paragraph[start:match.end(1)])
+        start = match.end()
+    if paragraph[start:].strip():
+        sentences.append(paragraph[start:])
+    return [" ".join(sentence.split()) for sentence in sentences if sentence.strip()]
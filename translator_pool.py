@@ -0,0 +1,113 @@
+from contextlib import contextmanager
+from selenium.common.exceptions import WebDriverException
+from selenium_translation_manager import SeleniumTranslationManger
+import os
+import threading
+import time
+
+
+class TranslatorPoolExhausted(Exception):
+    pass
+
+
+class TranslatorPool:
+
+    def __init__(self, max_sessions=None, max_uses=None, checkout_timeout=None):
+        self.max_sessions = max_sessions or int(os.getenv("TRANSLATOR_POOL_SIZE", 2))
+        self.max_uses = max_uses or int(os.getenv("TRANSLATOR_MAX_USES", 200))
+        self.checkout_timeout = checkout_timeout or float(os.getenv("TRANSLATOR_CHECKOUT_TIMEOUT", 30))
+        # Most recently returned session first, so idle sessions beyond what the load needs are the ones left to age
+        self.idle = []
+        self.lock = threading.Lock()
+        # Notified whenever a session is checked in or a slot is freed, so a waiter can take either one
+        self.available = threading.Condition(self.lock)
+        self.open_sessions = 0
+
+    @contextmanager
+    def session(self):
+        translator = self.checkout()
+        try:
+            yield translator
+        except WebDriverException:
+            self.checkin(translator, broken=True)
+            raise
+        except Exception:
+            self.checkin(translator)
+            raise
+        else:
+            self.checkin(translator)
+
+    def checkout(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            translator = self._wait_for_session(deadline)
+            if translator is None:
+                return self._open_session()
+            if translator.is_healthy():
+                return translator
+            print("Discarding unhealthy web driver")
+            self._discard(translator)
+
+    def checkin(self, translator, broken=False):
+        translator.uses += 1
+        if broken or translator.uses >= self.max_uses:
+            self._discard(translator)
+        else:
+            with self.available:
+                self.idle.append(translator)
+                self.available.notify()
+
+    def close(self):
+        while True:
+            translator = self._take_idle()
+            if translator is None:
+                break
+            self._discard(translator)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "open": self.open_sessions,
+                "idle": len(self.idle),
+                "max": self.max_sessions
+            }
+
+    def _take_idle(self):
+        with self.lock:
+            return self.idle.pop() if self.idle else None
+
+    def _wait_for_session(self, deadline):
+        # An idle session, or None once a slot has been reserved for a new one
+        with self.available:
+            while True:
+                if self.idle:
+                    return self.idle.pop()
+                if self.open_sessions < self.max_sessions:
+                    self.open_sessions += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TranslatorPoolExhausted(f"No translator available after {self.checkout_timeout} seconds")
+                self.available.wait(remaining)
+
+    def _release_slot(self):
+        with self.available:
+            self.open_sessions -= 1
+            self.available.notify()
+
+    def _open_session(self):
+        translator = SeleniumTranslationManger()
+        try:
+            translator.initialise_webdriver()
+        except Exception:
+            self._release_slot()
+            raise
+        return translator
+
+    def _discard(self, translator):
+        try:
+            translator.close_webdriver()
+        except WebDriverException as e:
+            print(f"Error closing web driver: {e}")
+        finally:
+            self._release_slot()
@@ -0,0 +1,32 @@
+from collections import Counter
+from datetime import datetime
+import threading
+
+
+class UsageMeter:
+
+    def __init__(self):
+        self.counts = Counter()
+        self.last_request = {}
+        self.lock = threading.Lock()
+
+    def record(self, consumer_id):
+        with self.lock:
+            self.counts[consumer_id] += 1
+            self.last_request[consumer_id] = datetime.utcnow().date()
+
+    def drain(self):
+        # Hands back everything counted since the last drain, as (consumer_id, count, last_request) tuples
+        with self.lock:
+            counts = self.counts
+            last_request = self.last_request
+            self.counts = Counter()
+            self.last_request = {}
+        return [(consumer_id, count, last_request[consumer_id]) for consumer_id, count in counts.items()]
+
+    def restore(self, usage):
+        # Puts back counts that could not be written so the next flush tries again
+        with self.lock:
+            for consumer_id, count, last_request in usage:
+                self.counts[consumer_id] += count
+                self.last_request[consumer_id] = max(last_request, self.last_request.get(consumer_id, last_request))
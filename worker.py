@@ -0,0 +1,11 @@
+from apscheduler.schedulers.blocking import BlockingScheduler
+from main import run_pending_jobs
+import os
+
+scheduler = BlockingScheduler()
+scheduler.add_job(run_pending_jobs, "interval", seconds=float(os.getenv("JOB_POLL_INTERVAL", 2)),
+                  max_instances=1, coalesce=True)
+
+if __name__ == "__main__":
+    print("Story job worker started")
+    scheduler.start()